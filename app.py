@@ -1,10 +1,13 @@
 import os
 import tempfile
+import uuid
 
 import streamlit as st
 
 from utilities.az_login import az_login
-from utilities.chat_with_pdf import ask_ai_with_pdf_context
+from utilities.chat_history import HISTORY_PAGE_SIZE, USER_ROLE, ChatHistory
+from utilities.chat_with_pdf import ask_ai_with_pdf_context, get_followup_suggestions
+from utilities.chunk_store import chunk_store, snippet
 from utilities.create_search_index import index_pdf_document
 from utilities.delete_search_index import delete_search_index
 
@@ -113,6 +116,56 @@ if not is_production and "azure_logged_in" not in st.session_state:
         except Exception as e:
             st.error(f"Error al autenticar con Azure: {e}")
 
+# Identificador de sesión para el control de admisión compartido
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+
+def queue_notifier(placeholder):
+    def notify(position: int):
+        placeholder.info(f"⏳ Hay mucha demanda: tu solicitud está en la posición {position} de la cola.")
+
+    return notify
+
+
+def ask_question(query: str):
+    messages = [{"role": "user", "content": query}]
+    queue_status = st.empty()
+    try:
+        with st.spinner("Consultando al modelo de lenguaje..."):
+            response = ask_ai_with_pdf_context(
+                messages,
+                context={
+                    "session_id": st.session_state.session_id,
+                    "overrides": {"citations": True},
+                },
+                on_queue=queue_notifier(queue_status),
+            )
+            st.session_state.chat_history.append(USER_ROLE, query)
+            st.session_state.chat_history.append(
+                "Asistente",
+                response["message"],
+                citations=response["citations"],
+            )
+    except Exception as e:
+        st.error(f"Ocurrió un error al consultar: {e}")
+    finally:
+        queue_status.empty()
+
+
+# Las sugerencias se calculan en segundo plano tras cada respuesta (junto con
+# su recuperación anticipada); el fragmento las muestra cuando están listas
+@st.fragment(run_every="3s")
+def followup_suggestions():
+    suggestions = get_followup_suggestions(st.session_state.session_id)
+    if suggestions:
+        st.caption("💡 Preguntas sugeridas")
+    for i, suggestion in enumerate(suggestions):
+        if st.button(suggestion, key=f"followup-{i}"):
+            st.session_state.suggested_query = suggestion
+            st.rerun()
+
+
 # Estructura en columnas con separación visual
 left_col, right_col = st.columns([1, 2], gap="large")
 
@@ -134,17 +187,33 @@ with left_col:
                     tmp.write(uploaded_file.read())
                     temp_pdf_path = tmp.name
 
+                queue_status = st.empty()
                 with st.spinner(f"Cargando e indexando '{uploaded_file.name}'..."):
                     try:
-                        index_pdf_document(
-                            index_name=index_name, pdf_path=temp_pdf_path
-                        )
-                        st.success(
-                            f"'{uploaded_file.name}' cargado e indexado exitosamente."
+                        result = index_pdf_document(
+                            index_name=index_name,
+                            pdf_path=temp_pdf_path,
+                            session_id=st.session_state.session_id,
+                            on_queue=queue_notifier(queue_status),
+                            document_name=uploaded_file.name,
                         )
+                        if result["indexed"]:
+                            st.success(
+                                f"'{uploaded_file.name}' cargado e indexado exitosamente."
+                            )
+                        else:
+                            st.info(
+                                f"El contenido de '{uploaded_file.name}' ya estaba indexado."
+                            )
+                        if result["indexed"] and result["duplicates"]:
+                            st.caption(
+                                f"{result['duplicates']} fragmento(s) repetido(s) no se volvieron a indexar."
+                            )
                     except Exception as e:
                         st.error(f"Error al indexar '{uploaded_file.name}': {e}")
                         st.session_state.pdf_ready = False
+                    finally:
+                        queue_status.empty()
 
         st.divider()
         st.subheader("🗑️ Eliminar base de conocimiento de IA")
@@ -162,7 +231,9 @@ with right_col:
         st.subheader("💬 Chat con tus PDFs")
 
         if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
+            st.session_state.chat_history = ChatHistory()
+        if "history_pages" not in st.session_state:
+            st.session_state.history_pages = 0
         if "query_input" not in st.session_state:
             st.session_state.query_input = ""
 
@@ -174,47 +245,44 @@ with right_col:
             )
             submit = st.form_submit_button("Enviar pregunta")
 
-            if submit and query:
-                messages = [{"role": "user", "content": query}]
-                try:
-                    with st.spinner("Consultando al modelo de lenguaje..."):
-                        response = ask_ai_with_pdf_context(messages)
-                        st.session_state.chat_history.append(("Usuario", query))
-                        st.session_state.chat_history.append(
-                            ("Asistente", response["message"])
-                        )
-                except Exception as e:
-                    st.error(f"Ocurrió un error al consultar: {e}")
+        # Una pregunta sugerida se envía igual que una escrita
+        suggested_query = st.session_state.pop("suggested_query", None)
+        if suggested_query or (submit and query):
+            ask_question(suggested_query or query)
 
+        # Se renderiza en un solo bloque: las entradas recientes ya vienen
+        # escapadas y en HTML, las archivadas solo se leen si se piden
         st.subheader("📒 Historial de conversación")
-        st.markdown("<div class='scrollable-chat'>", unsafe_allow_html=True)
-        for role, msg in reversed(st.session_state.chat_history):
-            css_class = "chat-user" if role == "Usuario" else "chat-assistant"
-            icon_html = (
-                f"<div class='chat-icon'>{'🧑‍💼' if role == 'Usuario' else '🤖'}</div>"
-            )
-            text_html = (
-                f"<div class='chat-text'><strong>{role}:</strong><br>{msg}</div>"
-            )
-
-            if role == "Usuario":
-                st.markdown(
-                    f"""
-                    <div class="chat-bubble {css_class}">
-                        {text_html}{icon_html}
-                    </div>
-                    """,
-                    unsafe_allow_html=True,
-                )
-            else:
+        history = st.session_state.chat_history
+        chat_html = history.render_recent() + history.render_archived(
+            st.session_state.history_pages
+        )
+        st.markdown(
+            f"<div class='scrollable-chat'>{chat_html}</div>", unsafe_allow_html=True
+        )
+        # Las citas solo guardan ids; página y extracto se buscan en el
+        # almacén local de fragmentos cuando el usuario pide verlas
+        citations = history.last_citations
+        if citations and st.toggle("📚 Ver fuentes de la última respuesta"):
+            index_name = os.getenv("AISEARCH_INDEX_NAME")
+            for citation in citations:
+                chunk = chunk_store.get(index_name, citation["id"])
+                if chunk is None:
+                    st.caption(f"[{citation['ref']}] Fuente no disponible")
+                    continue
                 st.markdown(
-                    f"""
-                    <div class="chat-bubble {css_class}">
-                        {icon_html}{text_html}
-                    </div>
-                    """,
-                    unsafe_allow_html=True,
+                    f"**[{citation['ref']}]** {chunk['title']} · página {chunk['page']}"
+                    f" · fragmento {chunk['chunk'] + 1}"
                 )
-        st.markdown("</div>", unsafe_allow_html=True)
+                st.caption(snippet(chunk["content"]))
+
+        followup_suggestions()
+
+        pending = history.archived - st.session_state.history_pages * HISTORY_PAGE_SIZE
+        if pending > 0 and st.button(
+            f"Ver mensajes anteriores ({pending} archivados)"
+        ):
+            st.session_state.history_pages += 1
+            st.rerun()
     else:
         st.info("Por favor sube e indexa al menos un PDF para habilitar el chat.")
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import Future
+
+from utilities.prefetch import Prefetcher
+
+
+def _run_with_timeout(fn, timeout=5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "submit se bloqueó"
+    return result["value"]
+
+
+def test_submit_does_not_deadlock_when_task_already_finished():
+    prefetcher = Prefetcher(workers=1)
+
+    def submit_done(fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    prefetcher._pool.submit = submit_done
+    future = _run_with_timeout(lambda: prefetcher.submit("q", lambda: 42, session_id="s1"))
+
+    assert future.result() == 42
+    assert prefetcher.inflight("q") is None
+
+
+def test_submit_reuses_inflight_task_across_sessions():
+    prefetcher = Prefetcher(workers=1)
+    release = threading.Event()
+    first = prefetcher.submit("q", release.wait, 5, session_id="s1")
+    second = prefetcher.submit("q", release.wait, 5, session_id="s2")
+    assert first is second
+
+    # s2 sigue necesitándola, así que la nueva ronda de s1 no la cancela
+    prefetcher.new_round("s1")
+    assert not first.cancelled()
+    release.set()
+    assert first.result(timeout=5) is True
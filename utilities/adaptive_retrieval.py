@@ -0,0 +1,66 @@
+import os
+from typing import Callable
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "adaptive")
+
+# Defaults for the retrieval budget; every key can be overridden per request
+# through context["overrides"]
+DEFAULT_BUDGET = {
+    "retrieval_mode": RETRIEVAL_MODE,  # "adaptive" or "fixed"
+    "top": 5,  # first-pass depth
+    "min_top": 2,  # never return fewer passages than this
+    "max_top": 20,  # depth of the escalated search
+    # cut the list once a score falls below (1 - score_gap) * best score
+    "score_gap": 0.35,
+    # semantic reranker scores range 0-4; below this the best hit is weak
+    "min_reranker_score": 2.0,
+}
+
+
+def retrieval_budget(overrides: dict = None, **defaults) -> dict:
+    budget = {**DEFAULT_BUDGET, **defaults}
+    budget.update({k: v for k, v in (overrides or {}).items() if k in DEFAULT_BUDGET})
+    return budget
+
+
+def result_score(result: dict) -> float:
+    reranker_score = result.get("@search.reranker_score")
+    if reranker_score is not None:
+        return reranker_score
+    return result.get("@search.score") or 0.0
+
+
+def cut_by_score(results: list, budget: dict) -> list:
+    """Keep results until the score drops too far below the best one."""
+    if not results:
+        return results
+    threshold = result_score(results[0]) * (1 - budget["score_gap"])
+    for i in range(budget["min_top"], len(results)):
+        if result_score(results[i]) < threshold:
+            return results[:i]
+    return results
+
+
+def is_confident(results: list, budget: dict) -> bool:
+    if not results:
+        return False
+    reranker_score = results[0].get("@search.reranker_score")
+    if reranker_score is not None and reranker_score < budget["min_reranker_score"]:
+        return False
+    # a full first page with no clear score gap means relevant passages may
+    # continue past the cut-off
+    return len(results) < budget["top"] or len(cut_by_score(results, budget)) < len(results)
+
+
+def adaptive_search(search: Callable[[int], list], budget: dict) -> list:
+    """
+    Run `search(top)` with the budget's first-pass depth, escalating to
+    `max_top` only when the first page does not look conclusive, and trim
+    the candidates at the first large score gap.
+    """
+    results = list(search(budget["top"]))
+    if budget["retrieval_mode"] != "adaptive":
+        return results
+    if not is_confident(results, budget) and budget["max_top"] > budget["top"]:
+        results = list(search(budget["max_top"]))
+    return cut_by_score(results, budget)
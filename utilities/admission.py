@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Hashable
+
+MAX_CONCURRENT_PER_SESSION = int(os.getenv("MAX_CONCURRENT_PER_SESSION", "1"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "60"))
+
+# Límites por deployment, p. ej. '{"gpt-4o": {"rpm": 60, "tpm": 30000}}'.
+# CHAT_MODEL_RPM/TPM y EMBEDDINGS_MODEL_RPM/TPM cubren los casos habituales.
+DEPLOYMENT_LIMITS = json.loads(os.getenv("DEPLOYMENT_LIMITS", "{}"))
+
+
+class AdmissionRejected(RuntimeError):
+    pass
+
+
+def estimate_tokens(content) -> int:
+    # Aproximación de ~4 caracteres por token; basta para repartir la cuota
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_tokens(item) for item in content)
+    if isinstance(content, dict):
+        return estimate_tokens(content.get("content") or "")
+    return len(str(content)) // 4 + 1
+
+
+def _limits_for(deployment: str) -> tuple[float | None, float | None]:
+    if deployment in DEPLOYMENT_LIMITS:
+        limits = DEPLOYMENT_LIMITS[deployment]
+        return limits.get("rpm"), limits.get("tpm")
+    for prefix in ("CHAT_MODEL", "EMBEDDINGS_MODEL"):
+        if deployment == os.getenv(prefix):
+            rpm = os.getenv(f"{prefix}_RPM")
+            tpm = os.getenv(f"{prefix}_TPM")
+            return (float(rpm) if rpm else None, float(tpm) if tpm else None)
+    return None, None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Ticket:
+    __slots__ = ("deployment", "session_id", "tokens")
+
+    def __init__(self, deployment: str, session_id: Hashable, tokens: int):
+        self.deployment = deployment
+        self.session_id = session_id
+        self.tokens = tokens
+
+
+class AdmissionController:
+    """
+    Controla el acceso a los deployments de Azure antes de enviar la petición:
+    token buckets de RPM/TPM por deployment, máximo de llamadas simultáneas por
+    sesión y una cola FIFO acotada con tiempo de espera.
+    """
+
+    def __init__(
+        self,
+        max_per_session: int = MAX_CONCURRENT_PER_SESSION,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        timeout: float = ADMISSION_TIMEOUT,
+    ):
+        self.max_per_session = max_per_session
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue: deque[_Ticket] = deque()
+        self._active = Counter()
+        self._buckets: dict[str, list[tuple[TokenBucket, str]]] = {}
+
+    def configure(self, deployment: str, rpm: float = None, tpm: float = None):
+        with self._cond:
+            buckets = []
+            if rpm:
+                buckets.append((TokenBucket(rpm), "requests"))
+            if tpm:
+                buckets.append((TokenBucket(tpm), "tokens"))
+            self._buckets[deployment] = buckets
+
+    def _buckets_for(self, deployment: str) -> list[tuple[TokenBucket, str]]:
+        if deployment not in self._buckets:
+            self.configure(deployment, *_limits_for(deployment))
+        return self._buckets[deployment]
+
+    def _position(self, ticket: _Ticket) -> int:
+        # Posición entre las peticiones al mismo deployment que pueden avanzar
+        position = 0
+        for other in self._queue:
+            if other is ticket:
+                return position
+            if (
+                other.deployment == ticket.deployment
+                and self._active[other.session_id] < self.max_per_session
+            ):
+                position += 1
+        return position
+
+    def _try_acquire(self, ticket: _Ticket) -> float | None:
+        """Devuelve 0 si la petición fue admitida, o cuánto esperar si no."""
+        if self._active[ticket.session_id] >= self.max_per_session:
+            return None
+        if self._position(ticket) > 0:
+            return None
+        now = time.monotonic()
+        buckets = self._buckets_for(ticket.deployment)
+        amounts = {"requests": 1, "tokens": ticket.tokens}
+        wait = max((b.wait_time(amounts[kind], now) for b, kind in buckets), default=0.0)
+        if wait > 0:
+            return wait
+        for bucket, kind in buckets:
+            bucket.take(amounts[kind])
+        return 0.0
+
+    @contextmanager
+    def admit(
+        self,
+        deployment: str,
+        session_id: str = None,
+        tokens: int = 1,
+        on_wait: Callable[[int], None] = None,
+    ):
+        # Sin sesión (scripts, llamadas internas) cada petición cuenta aparte en
+        # lugar de compartir un único cupo de concurrencia
+        ticket = _Ticket(deployment, session_id or object(), tokens)
+        deadline = time.monotonic() + self.timeout
+        last_position = None
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                raise AdmissionRejected(
+                    "Hay demasiadas consultas en curso, intenta de nuevo en unos segundos."
+                )
+            self._queue.append(ticket)
+        try:
+            while True:
+                notify = None
+                with self._cond:
+                    wait = self._try_acquire(ticket)
+                    if wait == 0:
+                        self._active[ticket.session_id] += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionRejected(
+                            "Se agotó el tiempo de espera en la cola, intenta de nuevo."
+                        )
+                    position = self._position(ticket)
+                    if on_wait and position != last_position:
+                        notify = position + 1
+                        last_position = position
+                    else:
+                        self._cond.wait(timeout=min(remaining, wait or 0.5))
+                # El aviso (p. ej. un placeholder de Streamlit) se hace fuera
+                # del lock para no frenar la admisión del resto de sesiones
+                if notify is not None:
+                    on_wait(notify)
+        finally:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[ticket.session_id] -= 1
+                if not self._active[ticket.session_id]:
+                    del self._active[ticket.session_id]
+                self._cond.notify_all()
+
+
+# Compartido por todas las sesiones de Streamlit del proceso
+admission_controller = AdmissionController()
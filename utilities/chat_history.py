@@ -0,0 +1,141 @@
+import html
+import json
+import os
+import tempfile
+import time
+import uuid
+import weakref
+from collections import deque
+from pathlib import Path
+
+# Turnos que se mantienen en memoria; los anteriores se archivan en disco
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+ARCHIVE_DIR = Path(
+    os.getenv("CHAT_HISTORY_DIR", Path(tempfile.gettempdir()) / "chat_history")
+)
+# Los archivos de sesiones que no se cerraron limpiamente se borran pasado
+# este tiempo (en horas)
+ARCHIVE_MAX_AGE_HOURS = float(os.getenv("CHAT_HISTORY_MAX_AGE_HOURS", "24"))
+
+USER_ROLE = "Usuario"
+
+# Archivos de los historiales aún vivos en este proceso: la purga no los toca
+# aunque lleven tiempo sin cambios
+_live_archives: set[Path] = set()
+
+
+def render_message(role: str, message: str) -> str:
+    # El contenido se escapa y los saltos de línea se convierten en <br> para
+    # que Markdown no corte el bloque HTML
+    text = html.escape(message).replace("\n", "<br>")
+    is_user = role == USER_ROLE
+    css_class = "chat-user" if is_user else "chat-assistant"
+    icon_html = f"<div class='chat-icon'>{'🧑‍💼' if is_user else '🤖'}</div>"
+    text_html = (
+        f"<div class='chat-text'><strong>{html.escape(role)}:</strong><br>{text}</div>"
+    )
+    inner = text_html + icon_html if is_user else icon_html + text_html
+    return f"<div class='chat-bubble {css_class}'>{inner}</div>"
+
+
+def _discard_archive(path: Path):
+    _live_archives.discard(path)
+    path.unlink(missing_ok=True)
+
+
+def purge_archives(archive_dir: Path = ARCHIVE_DIR, max_age_hours: float = ARCHIVE_MAX_AGE_HOURS):
+    """Elimina los archivos de historial sin modificar desde hace `max_age_hours`."""
+    cutoff = time.time() - max_age_hours * 3600
+    for path in Path(archive_dir).glob("*.jsonl"):
+        try:
+            if path not in _live_archives and path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            continue
+
+
+class ChatHistory:
+    """
+    Historial de conversación acotado. Las últimas entradas se guardan ya
+    renderizadas; las anteriores se archivan en un JSONL y se leen por páginas
+    solo cuando el usuario las pide.
+    """
+
+    def __init__(self, window: int = HISTORY_WINDOW, archive_dir: Path = ARCHIVE_DIR):
+        self.window = window
+        # (rol, mensaje, html, citas); las citas son solo ids de fragmentos
+        self.recent: deque[tuple[str, str, str, list]] = deque()
+        self.archive_path = Path(archive_dir) / f"{uuid.uuid4().hex}.jsonl"
+        # El archivo se borra cuando Streamlit descarta la sesión (y con ella
+        # este objeto); los que queden huérfanos se purgan por antigüedad
+        _live_archives.add(self.archive_path)
+        self._finalizer = weakref.finalize(self, _discard_archive, self.archive_path)
+        purge_archives(archive_dir)
+        # Posición en bytes de cada entrada archivada, para leer páginas sueltas
+        self._offsets: list[int] = []
+        self._html: str | None = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self.recent)
+
+    @property
+    def archived(self) -> int:
+        return len(self._offsets)
+
+    def append(self, role: str, message: str, citations: list = None):
+        self.recent.append(
+            (role, message, render_message(role, message), citations or [])
+        )
+        self._html = None
+        if len(self.recent) > self.window:
+            self._archive(self.recent.popleft())
+
+    @property
+    def last_citations(self) -> list:
+        for role, _, _, citations in reversed(self.recent):
+            if role != USER_ROLE:
+                return citations
+        return []
+
+    def _archive(self, entry: tuple[str, str, str, list]):
+        role, message, _, citations = entry
+        self.archive_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.archive_path, "ab") as f:
+            self._offsets.append(f.tell())
+            line = json.dumps(
+                {"role": role, "message": message, "citations": citations},
+                ensure_ascii=False,
+            )
+            f.write(line.encode("utf-8") + b"\n")
+
+    def render_recent(self) -> str:
+        """HTML de las entradas en memoria, de la más reciente a la más antigua."""
+        if self._html is None:
+            self._html = "".join(entry[2] for entry in reversed(self.recent))
+        return self._html
+
+    def render_archived(self, pages: int, page_size: int = HISTORY_PAGE_SIZE) -> str:
+        """HTML de las `pages` páginas archivadas más recientes."""
+        start = max(0, self.archived - pages * page_size)
+        if start >= self.archived:
+            return ""
+        bubbles = []
+        try:
+            with open(self.archive_path, "rb") as f:
+                f.seek(self._offsets[start])
+                for _ in range(start, self.archived):
+                    entry = json.loads(f.readline())
+                    bubbles.append(render_message(entry["role"], entry["message"]))
+        except FileNotFoundError:
+            # Lo borró otro proceso que comparte el directorio: lo archivado se
+            # pierde, pero la sesión sigue con las entradas en memoria
+            self._offsets.clear()
+            return ""
+        return "".join(reversed(bubbles))
+
+    def clear(self):
+        self.recent.clear()
+        self._offsets.clear()
+        self._html = None
+        self.archive_path.unlink(missing_ok=True)
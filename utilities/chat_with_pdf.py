@@ -1,63 +1,222 @@
+import functools
+import json
 import os
+import re
 from pathlib import Path
+from typing import Callable
 
 from azure.ai.inference.prompts import PromptTemplate
-from azure.ai.projects import AIProjectClient
 from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential
 from azure.search.documents import SearchClient
 from opentelemetry import trace
+from utilities.admission import estimate_tokens
+from utilities.adaptive_retrieval import adaptive_search, retrieval_budget
 from utilities.config import ASSET_PATH, get_logger
+from utilities.model_router import get_router
+from utilities.prefetch import PREFETCH_ENABLED, PREFETCH_WAIT, prefetcher
+from utilities.request_log import record_cache, request_context, stage
+from utilities.retrieval_cache import RetrievalCache
 
 logger = get_logger(__name__)
 tracer = trace.get_tracer(__name__)
 
 
-def ask_ai_with_pdf_context(messages: list, context: dict = None) -> dict:
+# Compartida por todas las sesiones; se invalida al reindexar
+retrieval_cache = RetrievalCache()
+
+
+@functools.lru_cache(maxsize=None)
+def _pdf_search_client(index_name: str) -> SearchClient:
+    return SearchClient(
+        endpoint=os.environ["SEARCH_SERVICE_ENDPOINT"],
+        index_name=index_name,
+        credential=AzureKeyCredential(os.environ["SEARCH_API_KEY"]),
+    )
+
+
+def _retrieval_key(query: str, overrides: dict) -> tuple:
+    budget = retrieval_budget(overrides)
+    return retrieval_cache.key(
+        os.environ["AISEARCH_INDEX_NAME"],
+        query,
+        top=(tuple(sorted(budget.items())), bool(overrides.get("semantic_ranker"))),
+    )
+
+
+def retrieve_pdf_passages(
+    query: str, overrides: dict = None, use_prefetch: bool = True
+) -> list[dict]:
+    """
+    Busca los pasajes del índice de PDFs para una consulta. Reutiliza la caché
+    y, si hay una recuperación anticipada en curso para la misma consulta,
+    espera su resultado en lugar de repetir la búsqueda.
+    """
+    overrides = overrides or {}
+    key = _retrieval_key(query, overrides)
+    passages = retrieval_cache.get(key)
+    record_cache("retrieval", passages is not None)
+    if passages is not None:
+        return passages
+
+    pending = prefetcher.inflight(key) if use_prefetch else None
+    if pending is not None:
+        try:
+            with stage("prefetch_wait"):
+                passages = pending.result(timeout=PREFETCH_WAIT)
+            record_cache("prefetch", True)
+            return passages
+        except Exception as e:
+            logger.debug(f"Prefetch de '{query}' no disponible: {e}")
+
+    # Buscar en índice de PDF. En modo adaptativo se corta la lista en el
+    # primer salto grande de puntaje y solo se profundiza si hay poca confianza
+    budget = retrieval_budget(overrides)
+    search_kwargs = {}
+    if overrides.get("semantic_ranker"):
+        search_kwargs = {
+            "query_type": "semantic",
+            "semantic_configuration_name": "default",
+        }
+    pdf_search_client = _pdf_search_client(os.environ["AISEARCH_INDEX_NAME"])
+
+    def search(top: int) -> list:
+        return pdf_search_client.search(
+            query, select=["id", "title", "content"], top=top, **search_kwargs
+        )
+
+    with stage("retrieval"):
+        passages = [
+            {"id": result["id"], "title": result["title"], "content": result["content"]}
+            for result in adaptive_search(search, budget)
+        ]
+    retrieval_cache.set(key, passages)
+    return passages
+
+
+def _generate_followups(question: str, answer: str, session_id: str) -> list[str]:
+    prompty = PromptTemplate.from_prompty(Path(ASSET_PATH) / "followup_queries.prompty")
+    prompt_messages = prompty.create_messages(question=question, answer=answer)
+    model_env = "PREFETCH_MODEL" if os.getenv("PREFETCH_MODEL") else "CHAT_MODEL"
+    response = get_router(model_env).call(
+        lambda chat, model: chat.complete(
+            model=model, messages=prompt_messages, **prompty.parameters
+        ),
+        tokens=estimate_tokens(prompt_messages) + prompty.parameters.get("max_tokens", 200),
+        # Sesión aparte para no ocupar el cupo de concurrencia del usuario
+        session_id=f"{session_id}:prefetch",
+    )
+    content = response.choices[0].message.content
+    try:
+        queries = json.loads(content)
+    except ValueError:
+        queries = [line.strip("-•* ").strip() for line in content.splitlines()]
+    return [q for q in queries if isinstance(q, str) and q.strip()][:3]
+
+
+def prefetch_followups(question: str, answer: str, context: dict):
+    """
+    Predice en segundo plano las preguntas de seguimiento más probables y
+    precalienta la caché de recuperación con ellas.
+    """
+    session_id = context.get("session_id") or "anonymous"
+    overrides = context.get("overrides", {})
+    prefetcher.new_round(session_id)
+
+    def run():
+        # Corre en otro hilo: su coste se registra como una petición aparte
+        with request_context(
+            "prefetch", user=session_id, index=os.environ["AISEARCH_INDEX_NAME"]
+        ):
+            queries = _generate_followups(question, answer, session_id)
+        for query in queries:
+            prefetcher.submit(
+                _retrieval_key(query, overrides),
+                retrieve_pdf_passages,
+                query,
+                overrides,
+                False,
+                session_id=session_id,
+            )
+        prefetcher.set_suggestions(session_id, queries)
+
+    prefetcher.submit(("followups", session_id, question), run, session_id=session_id)
+
+
+def get_followup_suggestions(session_id: str) -> list[str]:
+    return prefetcher.suggestions(session_id)
+
+
+def ask_ai_with_pdf_context(
+    messages: list, context: dict = None, on_queue: Callable[[int], None] = None
+) -> dict:
     """
     Realiza una consulta a la IA usando documentos indexados en Azure Search (solo PDFs).
+    `on_queue` recibe la posición en la cola mientras la consulta espera turno.
     """
     if context is None:
         context = {}
 
-    # Crear cliente de proyecto
-    project = AIProjectClient.from_connection_string(
-        conn_str=os.environ["AIPROJECT_CONNECTION_STRING"],
-        credential=DefaultAzureCredential(),
-    )
-    chat = project.inference.get_chat_completions_client()
+    # Una línea en el registro de peticiones por consulta: tokens, coste,
+    # tiempos por etapa y aciertos de caché
+    with request_context(
+        "chat", user=context.get("session_id"), index=os.environ["AISEARCH_INDEX_NAME"]
+    ) as request:
+        context["trace_id"] = request.data["trace_id"]
 
-    # Crear cliente de búsqueda solo para PDFs
-    pdf_search_client = SearchClient(
-        endpoint=os.environ["SEARCH_SERVICE_ENDPOINT"],
-        index_name=os.environ["AISEARCH_INDEX_NAME"],
-        credential=AzureKeyCredential(os.environ["SEARCH_API_KEY"]),
-    )
+        # Extraer última pregunta del usuario
+        query = messages[-1]["content"]
+        overrides = context.get("overrides", {})
+        results = retrieve_pdf_passages(query, overrides)
 
-    # Extraer última pregunta del usuario
-    query = messages[-1]["content"]
+        # En modo citas cada pasaje lleva un id corto ([S1], [S2]...) que el
+        # modelo cita en la respuesta; solo se guardan los ids de los fragmentos
+        citations_mode = overrides.get("citations", False)
+        refs = {}
+        pdf_documents = []
+        for i, result in enumerate(results, start=1):
+            document = {"title": result["title"], "content": result["content"]}
+            if citations_mode:
+                refs[f"S{i}"] = result["id"]
+                document["id"] = f"S{i}"
+            pdf_documents.append(document)
 
-    # Buscar en índice de PDF
-    pdf_documents = []
-    for result in pdf_search_client.search(query):
-        pdf_documents.append({"title": result["title"], "content": result["content"]})
+        # Generar prompt contextualizado solo con documentos PDF
+        prompty_name = "grounded_chat_citations.prompty" if citations_mode else "grounded_chat.prompty"
+        grounded_prompt = PromptTemplate.from_prompty(Path(ASSET_PATH) / prompty_name)
+        system_message = grounded_prompt.create_messages(
+            documents=pdf_documents, context=context
+        )
 
-    # Generar prompt contextualizado solo con documentos PDF
-    grounded_prompt = PromptTemplate.from_prompty(
-        Path(ASSET_PATH) / "grounded_chat.prompty"
-    )
-    system_message = grounded_prompt.create_messages(
-        documents=pdf_documents, context=context
-    )
+        # Llamar al modelo a través del router: elige deployment, aplica el
+        # control de admisión y hace failover si hay 429 o errores del servicio
+        prompt_messages = system_message + messages
+        max_tokens = grounded_prompt.parameters.get("max_tokens", 1000)
+        response = get_router("CHAT_MODEL").call(
+            lambda chat, model: chat.complete(
+                model=model,
+                messages=prompt_messages,
+                **grounded_prompt.parameters,
+            ),
+            tokens=estimate_tokens(prompt_messages) + max_tokens,
+            session_id=context.get("session_id"),
+            on_wait=on_queue,
+        )
 
-    # Llamar al modelo
-    response = chat.complete(
-        model=os.environ["CHAT_MODEL"],
-        messages=system_message + messages,
-        **grounded_prompt.parameters,
-    )
+        message = response.choices[0].message.content
+        citations = []
+        if citations_mode:
+            for ref in dict.fromkeys(re.findall(r"\[(S\d+)\]", message)):
+                if ref in refs:
+                    citations.append({"ref": ref, "id": refs[ref]})
+            grounding = context.setdefault("grounding_data", [])
+            grounding.extend(c["id"] for c in citations if c["id"] not in grounding)
+
+        request.update(passages=len(results), citations=len(citations))
+        if PREFETCH_ENABLED:
+            prefetch_followups(query, message, context)
 
-    return {
-        "message": response.choices[0].message.content,
-        "context": context,
-    }
+        return {
+            "message": message,
+            "context": context,
+            "citations": citations,
+        }
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+CHUNK_STORE_PATH = Path(
+    os.getenv("CHUNK_STORE_PATH", Path(tempfile.gettempdir()) / "chunk_store.sqlite3")
+)
+SNIPPET_LENGTH = int(os.getenv("CITATION_SNIPPET_LENGTH", "240"))
+
+
+def snippet(content: str, length: int = SNIPPET_LENGTH) -> str:
+    text = " ".join(content.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(" ", 1)[0] + "…"
+
+
+class ChunkStore:
+    """
+    Copia local de los fragmentos indexados (documento, página, número de
+    fragmento y texto) para resolver citas sin volver a consultar el índice.
+    """
+
+    def __init__(self, path: Path = CHUNK_STORE_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 no comparte conexiones entre hilos; una por hilo
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT NOT NULL,
+                    index_name TEXT NOT NULL,
+                    title TEXT,
+                    page INTEGER,
+                    chunk INTEGER,
+                    content TEXT,
+                    PRIMARY KEY (index_name, id)
+                )
+                """
+            )
+            self._local.conn = conn
+        return conn
+
+    def put_many(self, index_name: str, chunks: list[dict]):
+        with self._conn as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (c["id"], index_name, c["title"], c["page"], c["chunk"], c["content"])
+                    for c in chunks
+                ],
+            )
+
+    def get(self, index_name: str, chunk_id: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT * FROM chunks WHERE index_name = ? AND id = ?", (index_name, chunk_id)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def delete_index(self, index_name: str):
+        with self._conn as conn:
+            conn.execute("DELETE FROM chunks WHERE index_name = ?", (index_name,))
+
+
+chunk_store = ChunkStore()
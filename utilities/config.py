@@ -16,6 +16,17 @@ load_dotenv()
 # Set "./assets" as the path where assets are stored, resolving the absolute path:
 ASSET_PATH = pathlib.Path(__file__).parent.resolve() / "assets"
 
+# Optional truncated embedding size for text-embedding-3 models (unset = full size)
+EMBEDDINGS_DIMENSIONS = int(os.getenv("EMBEDDINGS_DIMENSIONS", "0")) or None
+
+
+# Only text-embedding-3 models accept the `dimensions` parameter; returns the
+# value to send for `model`, or None to leave it out of the request
+def embeddings_dimensions_for(model):
+    if EMBEDDINGS_DIMENSIONS and model.startswith("text-embedding-3"):
+        return EMBEDDINGS_DIMENSIONS
+    return None
+
 # Configure an root app logger that prints info level logs to stdout
 logger = logging.getLogger("app")
 logger.setLevel(logging.INFO)
@@ -0,0 +1,111 @@
+import json
+import sys
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+from utilities.request_log import REQUEST_LOG_PATH
+
+
+def read_records(paths: Iterable[str], kind: str = None, since: str = None) -> Iterator[dict]:
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # partial line from a crashed writer
+                if "trace_id" not in record:
+                    continue
+                if kind and record.get("kind") != kind:
+                    continue
+                if since and record.get("timestamp", "") < since:
+                    continue
+                yield record
+
+
+def percentile(values: list[tuple[float, float]], p: float) -> float | None:
+    """
+    Weighted nearest-rank percentile over (value, weight) pairs. Errors and
+    slow requests are always logged at weight 1 while the rest are sampled,
+    so unweighted percentiles would be skewed towards the slow tail.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    target = p / 100 * sum(weight for _, weight in ordered)
+    cumulative = 0.0
+    for value, weight in ordered:
+        cumulative += weight
+        if cumulative >= target:
+            return value
+    return ordered[-1][0]
+
+
+def aggregate(records: Iterable[dict], group_by: str) -> list[dict]:
+    """
+    Totals per user or per index. Counts, tokens and cost are scaled by each
+    record's sample weight, and so are the latency percentiles.
+    """
+    groups = defaultdict(
+        lambda: {"requests": 0.0, "errors": 0.0, "cost_usd": 0.0, "tokens": defaultdict(float), "latencies": []}
+    )
+    for record in records:
+        weight = record.get("sample_weight", 1.0)
+        group = groups[record.get(group_by) or "-"]
+        group["requests"] += weight
+        group["errors"] += weight if record.get("error") else 0
+        group["cost_usd"] += weight * record.get("cost_usd", 0.0)
+        for name, count in record.get("tokens", {}).items():
+            group["tokens"][name] += weight * count
+        group["latencies"].append((record.get("latency_ms", 0.0), weight))
+
+    rows = []
+    for key, group in groups.items():
+        latencies = group.pop("latencies")
+        rows.append(
+            {
+                group_by: key,
+                "requests": round(group["requests"]),
+                "errors": round(group["errors"]),
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "tokens": {name: round(count) for name, count in group["tokens"].items()},
+                "cost_usd": round(group["cost_usd"], 4),
+            }
+        )
+    return sorted(rows, key=lambda row: row["cost_usd"], reverse=True)
+
+
+def format_table(rows: list[dict], group_by: str) -> str:
+    header = f"{group_by:<40} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'tokens':>10} {'cost USD':>10}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(
+            f"{str(row[group_by])[:40]:<40} {row['requests']:>9} {row['errors']:>7} "
+            f"{row['p50_ms'] or 0:>9.0f} {row['p95_ms'] or 0:>9.0f} "
+            f"{sum(row['tokens'].values()):>10} {row['cost_usd']:>10.4f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise the request log: p95 latency and cost per user and index")
+    parser.add_argument("logs", nargs="*", default=[str(REQUEST_LOG_PATH)], help="request log files (JSON lines)")
+    parser.add_argument("--by", choices=["user", "index"], nargs="+", default=["user", "index"], help="grouping")
+    parser.add_argument("--kind", type=str, help="only one request kind, e.g. 'chat' or 'index'")
+    parser.add_argument("--since", type=str, help="ISO timestamp, e.g. 2024-06-01T00:00")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of tables")
+
+    args = parser.parse_args()
+    records = list(read_records(args.logs, kind=args.kind, since=args.since))
+    if not records:
+        print("No request records found.", file=sys.stderr)
+        sys.exit(1)
+
+    report = {group_by: aggregate(records, group_by) for group_by in args.by}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("\n\n".join(format_table(rows, group_by) for group_by, rows in report.items()))
@@ -1,13 +1,17 @@
 import os
+import time
 
-import pandas as pd
 from azure.ai.projects import AIProjectClient
 from azure.ai.projects.models import ConnectionType
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 from azure.identity import DefaultAzureCredential
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
-from config import get_logger
+from utilities.config import ASSET_PATH, get_logger
+from utilities.product_ingest import iter_product_batches
+from utilities.product_sync import diff_catalog, get_alias_index, load_manifest, point_alias, save_manifest
+from utilities.retrieval_cache import bump_index_version
 
 # initialize logging object
 logger = get_logger(__name__)
@@ -62,13 +66,54 @@ def create_product_index_definition(index_name: str) -> SearchIndex:
 
 # Define Function To Add Documents To Index
 def create_docs_from_csv(path: str) -> list[dict[str, any]]:
-    df = pd.read_csv(path)
-    df["id"] = df["id"].astype(str)  # Ensure the 'id' field is treated as a string
-    docs = df.to_dict(orient="records")
-    return docs
+    # kept for callers that want the whole catalog in memory
+    return [doc for batch in iter_product_batches(path) for doc in batch]
 
 
-def create_index_from_csv(index_name, csv_file):
+def default_manifest_path(index_name: str) -> str:
+    manifest_dir = os.getenv("PRODUCT_MANIFEST_DIR", "manifests")
+    return os.path.join(manifest_dir, f"{index_name}.json")
+
+
+def get_search_client(index_name: str) -> SearchClient:
+    return SearchClient(
+        endpoint=search_connection.endpoint_url,
+        index_name=index_name,
+        credential=AzureKeyCredential(key=search_connection.key),
+    )
+
+
+def apply_changes(search_client: SearchClient, changes) -> tuple[int, int]:
+    upserted = deleted = 0
+    for action, items in changes:
+        if action == "upsert":
+            search_client.merge_or_upload_documents(items)
+            upserted += len(items)
+        else:
+            search_client.delete_documents([{"id": doc_id} for doc_id in items])
+            deleted += len(items)
+    return upserted, deleted
+
+
+def get_alias_target(name: str) -> str | None:
+    return get_alias_index(search_connection.endpoint_url, search_connection.key, name)
+
+
+def index_exists(index_name: str) -> bool:
+    try:
+        index_client.get_index(index_name)
+        return True
+    except ResourceNotFoundError:
+        return False
+
+
+def create_index_from_file(index_name, input_file, manifest_path=None):
+    if get_alias_target(index_name):
+        # an alias cannot be recreated in place; rebuild behind it instead
+        logger.info(f"🔀 '{index_name}' is an alias, rebuilding it with --swap")
+        swap_index_from_file(index_name, input_file, manifest_path)
+        return
+
     try:
         index_definition = index_client.get_index(index_name)
         index_client.delete_index(index_name)
@@ -79,18 +124,72 @@ def create_index_from_csv(index_name, csv_file):
     index_definition = create_product_index_definition(index_name)
     index_client.create_index(index_definition)
 
-    docs = create_docs_from_csv(path=csv_file)
-
-    search_client = SearchClient(
-        endpoint=search_connection.endpoint_url,
-        index_name=index_name,
-        credential=AzureKeyCredential(key=search_connection.key),
-    )
-
-    search_client.upload_documents(docs)
-    logger.info(f"➕ Uploaded {len(docs)} documents to '{index_name}' index")
-
-
+    # upload batch by batch so memory stays flat regardless of catalog size;
+    # the manifest written here lets later runs use --sync
+    new_manifest = {}
+    changes = diff_catalog(iter_product_batches(input_file), {}, new_manifest)
+    uploaded, _ = apply_changes(get_search_client(index_name), changes)
+    save_manifest(manifest_path or default_manifest_path(index_name), new_manifest)
+    bump_index_version(index_name)
+    logger.info(f"➕ Uploaded {uploaded} documents to '{index_name}' index")
+
+
+def sync_index_from_file(index_name, input_file, manifest_path=None):
+    manifest_path = manifest_path or default_manifest_path(index_name)
+    # after a --swap the name is an alias; documents go to the index behind it
+    target_index = get_alias_target(index_name) or index_name
+    if index_exists(target_index):
+        manifest = load_manifest(manifest_path)
+    else:
+        index_client.create_index(create_product_index_definition(target_index))
+        manifest = {}
+        logger.info(f"🆕 Created missing index '{target_index}'")
+
+    # only rows whose hash changed since the last sync are sent
+    new_manifest = {}
+    changes = diff_catalog(iter_product_batches(input_file), manifest, new_manifest)
+    upserted, deleted = apply_changes(get_search_client(target_index), changes)
+    save_manifest(manifest_path, new_manifest)
+    if upserted or deleted:
+        bump_index_version(index_name)
+    logger.info(f"🔄 Synced '{index_name}' ({target_index}): {upserted} upserted, {deleted} deleted")
+
+
+def swap_index_from_file(alias, input_file, manifest_path=None):
+    # build a fresh physical index (e.g. after a schema change) and repoint
+    # the alias that clients query, so search never sees an empty index
+    new_index = f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+    previous_index = get_alias_target(alias)
+    # first swap of a name that is still a physical index: aliases and indexes
+    # share a namespace, so the old index has to go before the alias exists
+    migrating = previous_index is None and index_exists(alias)
+
+    index_client.create_index(create_product_index_definition(new_index))
+    new_manifest = {}
+    changes = diff_catalog(iter_product_batches(input_file), {}, new_manifest)
+    uploaded, _ = apply_changes(get_search_client(new_index), changes)
+
+    if migrating:
+        logger.warning(
+            f"⚠️  Replacing index '{alias}' with an alias of the same name; "
+            "queries fail until the alias is created"
+        )
+        index_client.delete_index(alias)
+    point_alias(search_connection.endpoint_url, search_connection.key, alias, new_index)
+    save_manifest(manifest_path or default_manifest_path(alias), new_manifest)
+    bump_index_version(alias)
+    logger.info(f"🔀 Alias '{alias}' now points to '{new_index}' ({uploaded} documents)")
+
+    if previous_index and previous_index != new_index:
+        index_client.delete_index(previous_index)
+        logger.info(f"🗑️  Deleted previous index '{previous_index}'")
+
+
+# previous name, kept for existing callers
+create_index_from_csv = create_index_from_file
+
+
+# run from the repository root: python -m utilities.create-product-index --sync
 if __name__ == "__main__":
     import argparse
 
@@ -102,13 +201,36 @@ if __name__ == "__main__":
         default=os.environ["PRODUCT_INDEX_NAME"],
     )
     parser.add_argument(
+        "--input-file",
         "--csv-file",
+        dest="input_file",
+        type=str,
+        help="path to a CSV, NDJSON or Parquet file for creating product index",
+        default=str(ASSET_PATH / "products.csv"),
+    )
+    parser.add_argument(
+        "--manifest",
         type=str,
-        help="path to CSV file for creating product index",
-        default="assets/products.csv",
+        help="path to the row-hash manifest (default: manifests/<index-name>.json)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--sync",
+        action="store_true",
+        help="apply only the upserts and deletes since the last run",
+    )
+    mode.add_argument(
+        "--swap",
+        action="store_true",
+        help="treat --index-name as an alias, build a new index and repoint the alias",
     )
     args = parser.parse_args()
     index_name = args.index_name
-    csv_file = args.csv_file
-
-    create_index_from_csv(index_name, csv_file)
+    input_file = args.input_file
+
+    if args.sync:
+        sync_index_from_file(index_name, input_file, args.manifest)
+    elif args.swap:
+        swap_index_from_file(index_name, input_file, args.manifest)
+    else:
+        create_index_from_file(index_name, input_file, args.manifest)
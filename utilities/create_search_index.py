@@ -1,17 +1,25 @@
+import json
 import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Callable
 
-import fitz  # PyMuPDF
 from azure.ai.projects import AIProjectClient
 from azure.ai.projects.models import ConnectionType
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 from azure.identity import DefaultAzureCredential
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
     ExhaustiveKnnAlgorithmConfiguration,
+    BinaryQuantizationCompression,
     ExhaustiveKnnParameters,
     HnswAlgorithmConfiguration,
     HnswParameters,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
     SearchableField,
     SearchField,
     SearchFieldDataType,
@@ -26,18 +34,229 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmMetric,
     VectorSearchProfile,
 )
-from utilities.config import get_logger
+from utilities.admission import estimate_tokens
+from utilities.chunk_store import chunk_store
+from utilities.config import embeddings_dimensions_for, get_logger
+from utilities.dedup import SignatureIndex, signature_lock
+from utilities.model_router import get_router
+from utilities.pdf_extraction import chunk_page, file_sha256, iter_pdf_windows
+from utilities.request_log import request_context, stage, timed
+from utilities.retrieval_cache import bump_index_version, get_index_version
 
 logger = get_logger(__name__)
 
+# Compresión de vectores: "none", "scalar" (int8) o "binary"
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none").lower()
+# Sobremuestreo de candidatos que se re-puntúan con los vectores originales
+VECTOR_OVERSAMPLING = float(os.getenv("VECTOR_OVERSAMPLING", "10"))
+# Guardar una copia recuperable del vector (no hace falta para buscar)
+VECTOR_STORED = os.getenv("VECTOR_STORED", "true").lower() == "true"
+
+HNSW_M = int(os.getenv("HNSW_M", "4"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "400"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "500"))
+
+# Fragmentos por llamada de embeddings
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+
+# Progreso de cada ingesta por ventanas, para retomarla si falla
+CHECKPOINT_DIR = Path(
+    os.getenv(
+        "INGEST_CHECKPOINT_DIR", Path(tempfile.gettempdir()) / "ingest_checkpoints"
+    )
+)
+
+
+def embedding_dimensions(model: str) -> int:
+    # Los modelos text-embedding-3 admiten vectores truncados vía `dimensions`
+    dimensions = embeddings_dimensions_for(model)
+    if dimensions:
+        return dimensions
+    return 3072 if model == "text-embedding-3-large" else 1536
+
+
+def create_index_definition(
+    index_name: str,
+    model: str,
+    dimensions: int = None,
+    compression: str = VECTOR_COMPRESSION,
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+    ef_search: int = HNSW_EF_SEARCH,
+    stored: bool = VECTOR_STORED,
+) -> SearchIndex:
+    if dimensions is None:
+        dimensions = embedding_dimensions(model)
+
+    compressions = []
+    if compression == "scalar":
+        compressions.append(
+            ScalarQuantizationCompression(
+                compression_name="myCompression",
+                rerank_with_original_vectors=True,
+                default_oversampling=VECTOR_OVERSAMPLING,
+                parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+            )
+        )
+    elif compression == "binary":
+        compressions.append(
+            BinaryQuantizationCompression(
+                compression_name="myCompression",
+                rerank_with_original_vectors=True,
+                default_oversampling=VECTOR_OVERSAMPLING,
+            )
+        )
+    elif compression != "none":
+        raise ValueError(f"Compresión de vectores no soportada: '{compression}'")
+    compression_name = "myCompression" if compressions else None
+
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SimpleField(name="filepath", type=SearchFieldDataType.String),
+        SearchableField(name="title", type=SearchFieldDataType.String),
+        SimpleField(name="url", type=SearchFieldDataType.String),
+        SearchField(
+            name="contentVector",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            stored=stored,
+            vector_search_dimensions=dimensions,
+            vector_search_profile_name="myHnswProfile",
+        ),
+    ]
+    return SearchIndex(
+        name=index_name,
+        fields=fields,
+        semantic_search=SemanticSearch(
+            configurations=[
+                SemanticConfiguration(
+                    name="default",
+                    prioritized_fields=SemanticPrioritizedFields(
+                        title_field=SemanticField(field_name="title"),
+                        content_fields=[SemanticField(field_name="content")],
+                    ),
+                )
+            ]
+        ),
+        vector_search=VectorSearch(
+            algorithms=[
+                HnswAlgorithmConfiguration(
+                    name="myHnsw",
+                    kind=VectorSearchAlgorithmKind.HNSW,
+                    parameters=HnswParameters(
+                        m=m,
+                        ef_construction=ef_construction,
+                        ef_search=ef_search,
+                        metric=VectorSearchAlgorithmMetric.COSINE,
+                    ),
+                ),
+                ExhaustiveKnnAlgorithmConfiguration(
+                    name="myExhaustiveKnn",
+                    kind=VectorSearchAlgorithmKind.EXHAUSTIVE_KNN,
+                    parameters=ExhaustiveKnnParameters(
+                        metric=VectorSearchAlgorithmMetric.COSINE,
+                    ),
+                ),
+            ],
+            profiles=[
+                VectorSearchProfile(
+                    name="myHnswProfile",
+                    algorithm_configuration_name="myHnsw",
+                    compression_name=compression_name,
+                ),
+                VectorSearchProfile(
+                    name="myExhaustiveKnnProfile",
+                    algorithm_configuration_name="myExhaustiveKnn",
+                    compression_name=compression_name,
+                ),
+            ],
+            compressions=compressions,
+        ),
+    )
+
+
+def document_id(name: str) -> str:
+    # Las claves de Azure AI Search solo admiten letras, dígitos, "_", "-" y "="
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return re.sub(r"[^A-Za-z0-9_\-=]", "_", stem)
+
+
+def _checkpoint_path(index_name: str, file_hash: str) -> Path:
+    return CHECKPOINT_DIR / f"{index_name}-{file_hash}.json"
+
+
+def _load_checkpoint(path: Path, version: int) -> dict:
+    empty = {"next_page": 0, "chunks": 0, "indexed": 0, "duplicates": 0}
+    try:
+        checkpoint = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return empty
+    # Si el índice cambió desde entonces (p. ej. se eliminó) se empieza de cero
+    if checkpoint.get("version") != version:
+        return empty
+    return checkpoint
+
+
+def _discard_checkpoints(index_name: str):
+    # Los nombres son "<índice>-<sha256>.json"; se comprueba el hash para no
+    # tocar los de otro índice cuyo nombre empiece igual
+    for path in CHECKPOINT_DIR.glob(f"{index_name}-*.json"):
+        if re.fullmatch(r"[0-9a-f]{64}", path.stem[len(index_name) + 1 :]):
+            path.unlink(missing_ok=True)
+
+
+def _save_checkpoint(path: Path, checkpoint: dict):
+    CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoint))
+    tmp.replace(path)
+
+
+def index_pdf_document(
+    index_name: str,
+    pdf_path: str,
+    session_id: str = None,
+    on_queue: Callable[[int], None] = None,
+    document_name: str = None,
+) -> dict:
+    """
+    Indexa un PDF por fragmentos, procesándolo por ventanas de páginas para
+    acotar la memoria. Tras cada ventana se guarda un checkpoint, así una
+    ingesta fallida se retoma desde la última ventana completada. Los
+    fragmentos idénticos o casi idénticos a otros ya indexados se omiten: la
+    búsqueda ya devuelve el existente.
+
+    La ingesta deja una línea en el registro de peticiones con los tokens de
+    embeddings, el coste y el tiempo de cada etapa.
+    """
+    with request_context(
+        "index", user=session_id, index=index_name, document=document_name or pdf_path
+    ) as request:
+        result = _index_pdf_document(index_name, pdf_path, session_id, on_queue, document_name)
+        request.update(**result)
+        return result
+
+
+def _index_pdf_document(
+    index_name: str,
+    pdf_path: str,
+    session_id: str = None,
+    on_queue: Callable[[int], None] = None,
+    document_name: str = None,
+) -> dict:
+    # Los ids de los fragmentos incluyen el hash del archivo: otro PDF con el
+    # mismo nombre genera ids nuevos en vez de sobrescribir los del anterior
+    file_hash = file_sha256(pdf_path)
+    name_id = document_id(document_name or pdf_path)
+    doc_id = f"{name_id}-{file_hash[:12]}"
+    title = document_name or name_id
 
-def index_pdf_document(index_name: str, pdf_path: str):
     # Inicializar clientes
     project = AIProjectClient.from_connection_string(
         conn_str=os.environ["AIPROJECT_CONNECTION_STRING"],
         credential=DefaultAzureCredential(),
     )
-    embeddings = project.inference.get_embeddings_client()
     search_connection = project.connections.get_default(
         connection_type=ConnectionType.AZURE_AI_SEARCH, include_credentials=True
     )
@@ -45,102 +264,118 @@ def index_pdf_document(index_name: str, pdf_path: str):
         endpoint=search_connection.endpoint_url,
         credential=AzureKeyCredential(key=search_connection.key),
     )
+    search_client = SearchClient(
+        endpoint=search_connection.endpoint_url,
+        index_name=index_name,
+        credential=AzureKeyCredential(key=search_connection.key),
+    )
+    router = get_router("EMBEDDINGS_MODEL", kind="embeddings")
 
-    def create_index_definition(model: str) -> SearchIndex:
-        dimensions = 3072 if model == "text-embedding-3-large" else 1536
-        fields = [
-            SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-            SearchableField(name="content", type=SearchFieldDataType.String),
-            SimpleField(name="filepath", type=SearchFieldDataType.String),
-            SearchableField(name="title", type=SearchFieldDataType.String),
-            SimpleField(name="url", type=SearchFieldDataType.String),
-            SearchField(
-                name="contentVector",
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                searchable=True,
-                vector_search_dimensions=dimensions,
-                vector_search_profile_name="myHnswProfile",
-            ),
-        ]
-        return SearchIndex(
-            name=index_name,
-            fields=fields,
-            semantic_search=SemanticSearch(
-                configurations=[
-                    SemanticConfiguration(
-                        name="default",
-                        prioritized_fields=SemanticPrioritizedFields(
-                            title_field=SemanticField(field_name="title"),
-                            content_fields=[SemanticField(field_name="content")],
-                        ),
-                    )
-                ]
-            ),
-            vector_search=VectorSearch(
-                algorithms=[
-                    HnswAlgorithmConfiguration(
-                        name="myHnsw",
-                        kind=VectorSearchAlgorithmKind.HNSW,
-                        parameters=HnswParameters(
-                            m=4,
-                            ef_construction=1000,
-                            ef_search=1000,
-                            metric=VectorSearchAlgorithmMetric.COSINE,
-                        ),
-                    ),
-                    ExhaustiveKnnAlgorithmConfiguration(
-                        name="myExhaustiveKnn",
-                        kind=VectorSearchAlgorithmKind.EXHAUSTIVE_KNN,
-                        parameters=ExhaustiveKnnParameters(
-                            metric=VectorSearchAlgorithmMetric.COSINE,
-                        ),
-                    ),
-                ],
-                profiles=[
-                    VectorSearchProfile(
-                        name="myHnswProfile", algorithm_configuration_name="myHnsw"
-                    ),
-                    VectorSearchProfile(
-                        name="myExhaustiveKnnProfile",
-                        algorithm_configuration_name="myExhaustiveKnn",
-                    ),
-                ],
+    # Crear el índice solo si no existe: los PDFs se acumulan hasta que se
+    # elimina la base de conocimiento
+    try:
+        index_client.get_index(index_name)
+    except ResourceNotFoundError:
+        index_definition = create_index_definition(
+            index_name, os.environ["EMBEDDINGS_MODEL"]
+        )
+        index_client.create_index(index_definition)
+        logger.info(f"🆕 Índice '{index_name}' creado.")
+        # Un índice nuevo no contiene nada de lo que registran las firmas de
+        # /tmp (p. ej. se eliminó fuera de la app): se descartan con la versión
+        bump_index_version(index_name)
+        # Y ninguna ingesta a medias puede retomarse: sus páginas no están
+        _discard_checkpoints(index_name)
+
+    def embed_and_upload(batch: list[dict]):
+        texts = [chunk["content"] for chunk in batch]
+        embedding = router.call(
+            lambda embeddings, model: embeddings.embed(
+                input=texts, model=model, dimensions=embeddings_dimensions_for(model)
             ),
+            tokens=estimate_tokens(texts),
+            session_id=session_id,
+            on_wait=on_queue,
         )
+        with stage("upload"):
+            search_client.upload_documents(
+                [
+                    {
+                        "id": chunk["id"],
+                        "content": chunk["content"],
+                        "filepath": document_name or pdf_path,
+                        "title": name_id,
+                        "url": f"/documents/{doc_id.lower()}",
+                        "contentVector": item.embedding,
+                    }
+                    for chunk, item in zip(batch, embedding.data)
+                ]
+            )
+            # Copia local para resolver las citas (página, fragmento, extracto)
+            chunk_store.put_many(index_name, [{**c, "title": title} for c in batch])
 
-    # Eliminar índice anterior si existe
-    try:
-        index_client.get_index(index_name)
-        index_client.delete_index(index_name)
-        logger.info(f"🗑️  Índice '{index_name}' eliminado.")
-    except Exception:
-        pass
-
-    # Crear nuevo índice
-    index_definition = create_index_definition(os.environ["EMBEDDINGS_MODEL"])
-    index_client.create_index(index_definition)
-
-    # Extraer texto y vectorizar
-    doc = fitz.open(pdf_path)
-    content = "".join(page.get_text() for page in doc)
-    doc_id = os.path.basename(pdf_path).replace(".pdf", "").replace(" ", "_")
-    embedding = embeddings.embed(input=content, model=os.environ["EMBEDDINGS_MODEL"])
-    document = [
-        {
-            "id": doc_id,
-            "content": content,
-            "filepath": pdf_path,
-            "title": doc_id,
-            "url": f"/documents/{doc_id.lower()}",
-            "contentVector": embedding.data[0].embedding,
-        }
-    ]
+    checkpoint_path = _checkpoint_path(index_name, file_hash)
+    with signature_lock(index_name):
+        version = get_index_version(index_name)
+        checkpoint = _load_checkpoint(checkpoint_path, version)
+        if checkpoint["next_page"]:
+            logger.info(f"⏩ Retomando '{title}' desde la página {checkpoint['next_page'] + 1}")
+        signatures = SignatureIndex(index_name, version)
 
-    # Subir documentos
-    search_client = SearchClient(
-        endpoint=search_connection.endpoint_url,
-        index_name=index_name,
-        credential=AzureKeyCredential(key=search_connection.key),
+        # Extraer (bloques y tablas en orden de lectura, OCR para páginas
+        # escaneadas), deduplicar, vectorizar y subir ventana por ventana
+        windows = iter_pdf_windows(pdf_path, checkpoint["next_page"])
+        for start_page, pages in timed(windows, "extract"):
+            batch = []
+            indexed = 0
+            for offset, page_text in enumerate(pages):
+                page_number = start_page + offset + 1
+                for n, text in enumerate(chunk_page(page_text)):
+                    chunk = {
+                        "id": f"{doc_id}-p{page_number}-c{n}",
+                        "page": page_number,
+                        "chunk": n,
+                        "content": text,
+                    }
+                    checkpoint["chunks"] += 1
+                    # Deduplicar contra lo ya indexado (hash exacto + MinHash)
+                    with stage("dedup"):
+                        existing_id, signature, digest = signatures.find_duplicate(text)
+                    if existing_id is not None:
+                        checkpoint["duplicates"] += 1
+                        continue
+                    signatures.add(chunk["id"], signature, digest)
+                    batch.append(chunk)
+                    # Se sube cada lote en cuanto se vectoriza para no
+                    # acumular vectores en memoria
+                    if len(batch) >= EMBED_BATCH_SIZE:
+                        embed_and_upload(batch)
+                        indexed += len(batch)
+                        batch = []
+            if batch:
+                embed_and_upload(batch)
+                indexed += len(batch)
+            checkpoint["indexed"] += indexed
+
+            if indexed:
+                version = bump_index_version(index_name)
+            signatures.save(version)
+            # La ventana queda completa: se anota para poder retomar después
+            checkpoint.update(next_page=start_page + len(pages), version=version)
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+    checkpoint_path.unlink(missing_ok=True)
+    if not checkpoint["chunks"]:
+        raise ValueError(f"No se pudo extraer texto de '{pdf_path}'.")
+
+    result = {
+        "doc_id": doc_id,
+        "chunks": checkpoint["chunks"],
+        "indexed": checkpoint["indexed"],
+        "duplicates": checkpoint["duplicates"],
+    }
+    logger.info(
+        f"✅ Documento '{pdf_path}' indexado en '{index_name}': "
+        f"{result['indexed']} fragmentos nuevos, {result['duplicates']} duplicados omitidos"
     )
-    search_client.upload_documents(document)
-    logger.info(f"✅ Documento '{pdf_path}' indexado en '{index_name}'")
+    return result
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+DEDUP_DIR = Path(os.getenv("DEDUP_DIR", Path(tempfile.gettempdir()) / "dedup_signatures"))
+# Similitud de Jaccard estimada a partir de la cual un fragmento es duplicado
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+
+NUM_PERM = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+
+_PRIME = (1 << 32) + 15
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, 1 << 32, size=(NUM_PERM, 1), dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, size=(NUM_PERM, 1), dtype=np.uint64)
+
+_locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    words = normalize_text(text).split()
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            for s in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # (a * x + b) mod p cabe en 64 bits porque a, b y x son de 32 bits
+    return ((_A * hashes + _B) % _PRIME).min(axis=1)
+
+
+class SignatureIndex:
+    """
+    Índice local de firmas de los fragmentos ya indexados en un índice de
+    búsqueda: hash exacto del contenido normalizado y MinHash con LSH por
+    bandas para detectar casi-duplicados. Se descarta si el índice de búsqueda
+    cambió de versión (p. ej. fue eliminado) desde que se guardó.
+    """
+
+    def __init__(self, index_name: str, version: int):
+        self.index_name = index_name
+        self.path = DEDUP_DIR / f"{index_name}.json"
+        self.version = version
+        self.exact: dict[str, str] = {}
+        self.signatures: dict[str, np.ndarray] = {}
+        self._buckets: dict[tuple, list[str]] = defaultdict(list)
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.version:
+            return
+        self.exact = data["exact"]
+        for chunk_id, signature in data["signatures"].items():
+            self._add_signature(chunk_id, np.asarray(signature, dtype=np.uint64))
+
+    def _bands(self, signature: np.ndarray):
+        rows = NUM_PERM // LSH_BANDS
+        for band in range(LSH_BANDS):
+            yield (band, *signature[band * rows : (band + 1) * rows].tolist())
+
+    def _add_signature(self, chunk_id: str, signature: np.ndarray):
+        self.signatures[chunk_id] = signature
+        for band in self._bands(signature):
+            self._buckets[band].append(chunk_id)
+
+    def find_duplicate(self, text: str) -> tuple[str | None, np.ndarray, str]:
+        """Devuelve (id existente o None, firma, hash) del fragmento."""
+        digest = content_hash(text)
+        signature = minhash_signature(text)
+        if digest in self.exact:
+            return self.exact[digest], signature, digest
+        candidates = {c for band in self._bands(signature) for c in self._buckets.get(band, ())}
+        best, best_score = None, DEDUP_THRESHOLD
+        for candidate in candidates:
+            score = float(np.mean(self.signatures[candidate] == signature))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best, signature, digest
+
+    def add(self, chunk_id: str, signature: np.ndarray, digest: str):
+        self.exact[digest] = chunk_id
+        self._add_signature(chunk_id, signature)
+
+    def save(self, version: int):
+        self.version = version
+        DEDUP_DIR.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": version,
+            "exact": self.exact,
+            "signatures": {k: v.tolist() for k, v in self.signatures.items()},
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data))
+        tmp.replace(self.path)
+
+
+def signature_lock(index_name: str) -> threading.Lock:
+    # Serializa las ingestas concurrentes sobre el mismo índice en el proceso
+    return _locks[index_name]
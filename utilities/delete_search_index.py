@@ -5,10 +5,13 @@ from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.indexes import SearchIndexClient
 from dotenv import load_dotenv
 
+from utilities.chunk_store import chunk_store
+from utilities.retrieval_cache import bump_index_version
+
 load_dotenv()
 
 
-def delete_search_index(index_name):
+def get_search_index_client() -> SearchIndexClient:
     service_endpoint = os.getenv("SEARCH_SERVICE_ENDPOINT")
     api_key = os.getenv("SEARCH_API_KEY")
 
@@ -17,17 +20,23 @@ def delete_search_index(index_name):
             "Please set the SEARCH_SERVICE_ENDPOINT and SEARCH_API_KEY environment variables."
         )
 
-    client = SearchIndexClient(
+    return SearchIndexClient(
         endpoint=service_endpoint, credential=AzureKeyCredential(api_key)
     )
+
+
+def delete_search_index(index_name, client: SearchIndexClient = None) -> str:
+    client = client or get_search_index_client()
     client.delete_index(index_name)
-    print(f"Search index '{index_name}' deleted successfully.")
+    bump_index_version(index_name)
+    chunk_store.delete_index(index_name)
+    return index_name
 
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
-        print("Usage: python delete-search-index.py <index-name>")
+        print("Usage: python -m utilities.delete_search_index <index-name>")
         sys.exit(1)
 
-    index_name = sys.argv[1]
-    delete_search_index(index_name)
+    index_name = delete_search_index(sys.argv[1])
+    print(f"Search index '{index_name}' deleted successfully.")
@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+
+from cachetools import LRUCache
+
+from utilities.admission import estimate_tokens
+from utilities.config import embeddings_dimensions_for
+from utilities.model_router import ModelRouter, get_router
+from utilities.request_log import record_cache, record_model_call
+
+# Ventana en la que se juntan las consultas que llegan a la vez y tamaño
+# máximo de cada llamada multi-input
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+# Llamadas por lotes que pueden estar en curso a la vez
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "4"))
+# Vectores de consultas recientes que se reutilizan sin volver a llamar
+EMBED_QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "2048"))
+# Máximo que una consulta espera a su lote; por encima del ADMISSION_TIMEOUT
+# para no cortar una llamada que solo estaba esperando turno
+EMBED_QUERY_TIMEOUT = float(os.getenv("EMBED_QUERY_TIMEOUT", "90"))
+
+
+class EmbeddingBatcher:
+    """
+    Vectoriza consultas por micro-lotes: las que llegan dentro de la misma
+    ventana de unos milisegundos se envían en una sola llamada multi-input, y
+    una consulta idéntica a otra ya en curso espera ese mismo resultado en
+    lugar de generar otra petición.
+    """
+
+    def __init__(
+        self,
+        router: ModelRouter,
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_batch: int = EMBED_BATCH_MAX,
+        workers: int = EMBED_BATCH_WORKERS,
+        cache_size: int = EMBED_QUERY_CACHE_SIZE,
+    ):
+        self.router = router
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._waiters: dict[str, int] = {}
+        self._vectors = LRUCache(maxsize=cache_size) if cache_size else None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="embed-batch")
+        self._collector = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._collector.start()
+
+    def embed(self, text: str, timeout: float = EMBED_QUERY_TIMEOUT) -> list[float]:
+        """Vector de `text`; bloquea hasta que se resuelve su lote."""
+        started = time.perf_counter()
+        with self._lock:
+            vector = self._vectors.get(text) if self._vectors is not None else None
+            future = None if vector is not None else self._inflight.get(text)
+            reused = vector is not None or future is not None
+            if vector is None:
+                if future is None:
+                    future = Future()
+                    self._inflight[text] = future
+                    self._waiters[text] = 0
+                    self._queue.put(text)
+                self._waiters[text] += 1
+        record_cache("query_embedding", reused)
+        if vector is not None:
+            return vector
+
+        vector, model, tokens = future.result(timeout=timeout)
+        # Cada consulta se queda con su parte de los tokens del lote, repartida
+        # entre las que compartieron el mismo texto
+        record_model_call(
+            model, time.perf_counter() - started, SimpleNamespace(prompt_tokens=tokens)
+        )
+        return vector
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # La llamada va en otro hilo para seguir juntando el próximo lote
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, texts: list[str]):
+        used = {}
+
+        def embed(embeddings, model):
+            used["model"] = model
+            return embeddings.embed(
+                model=model, input=texts, dimensions=embeddings_dimensions_for(model)
+            )
+
+        # Toda consulta del lote se resuelve pase lo que pase: si no, quien la
+        # espera se queda bloqueado (p. ej. una respuesta con menos vectores)
+        pending = dict.fromkeys(texts)
+        error = None
+        try:
+            # Sin session_id: cada lote cuenta aparte en el control de admisión,
+            # así no se limita a una llamada a la vez por el cupo por sesión
+            # (los límites RPM/TPM del deployment siguen aplicándose)
+            response = self.router.call(embed, tokens=estimate_tokens(texts))
+            estimates = [estimate_tokens(text) for text in texts]
+            total = getattr(response.usage, "prompt_tokens", 0) or 0
+            scale = total / max(1, sum(estimates))
+            items = sorted(response.data, key=lambda item: item.index)
+            for text, item, estimate in zip(texts, items, estimates):
+                del pending[text]
+                self._resolve(text, result=(item.embedding, used.get("model"), estimate * scale))
+        except Exception as e:
+            error = e
+        finally:
+            for text in pending:
+                self._resolve(
+                    text,
+                    error=error or RuntimeError("La respuesta de embeddings no incluye todos los vectores"),
+                )
+
+    def _resolve(self, text: str, result: tuple = None, error: Exception = None):
+        with self._lock:
+            future = self._inflight.pop(text)
+            waiters = self._waiters.pop(text)
+            if result is not None and self._vectors is not None:
+                self._vectors[text] = result[0]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            vector, model, tokens = result
+            future.set_result((vector, model, tokens / waiters))
+
+
+_batchers: dict[str, EmbeddingBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_embedding_batcher(model_env: str = "EMBEDDINGS_MODEL") -> EmbeddingBatcher:
+    """Batcher compartido por proceso para el modelo configurado en `model_env`."""
+    with _batchers_lock:
+        if model_env not in _batchers:
+            _batchers[model_env] = EmbeddingBatcher(get_router(model_env, kind="embeddings"))
+        return _batchers[model_env]
@@ -9,7 +9,13 @@ from azure.ai.projects.models import ConnectionType
 from azure.identity import DefaultAzureCredential
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
-from config import ASSET_PATH, get_logger
+from utilities.adaptive_retrieval import adaptive_search, retrieval_budget
+from utilities.admission import estimate_tokens
+from utilities.config import ASSET_PATH, get_logger
+from utilities.embedding_batcher import EMBED_QUERY_TIMEOUT, get_embedding_batcher
+from utilities.model_router import get_router
+from utilities.request_log import record_cache, request_context, stage
+from utilities.retrieval_cache import RetrievalCache
 
 # initialize logging and tracing objects
 logger = get_logger(__name__)
@@ -20,9 +26,11 @@ project = AIProjectClient.from_connection_string(
     conn_str=os.environ["AIPROJECT_CONNECTION_STRING"], credential=DefaultAzureCredential()
 )
 
-# create a vector embeddings client that will be used to generate vector embeddings
-chat = project.inference.get_chat_completions_client()
-embeddings = project.inference.get_embeddings_client()
+# chat and embedding calls are spread across the configured deployments
+# (INTENT_MAPPING_MODEL_DEPLOYMENTS / EMBEDDINGS_MODEL_DEPLOYMENTS) by the router;
+# query embeddings from concurrent sessions are micro-batched into shared calls
+chat_router = get_router("INTENT_MAPPING_MODEL")
+query_embedder = get_embedding_batcher("EMBEDDINGS_MODEL")
 
 # use the project client to get the default search connection
 search_connection = project.connections.get_default(
@@ -31,8 +39,9 @@ search_connection = project.connections.get_default(
 
 # Create a search index client using the search connection
 # This client will be used to create and delete search indexes
+index_name = os.environ["AISEARCH_INDEX_NAME"]
 search_client = SearchClient(
-    index_name=os.environ["AISEARCH_INDEX_NAME"],
+    index_name=index_name,
     endpoint=search_connection.endpoint_url,
     credential=AzureKeyCredential(key=search_connection.key),
 )
@@ -43,78 +52,118 @@ search_client = SearchClient(
 from azure.ai.inference.prompts import PromptTemplate
 from azure.search.documents.models import VectorizedQuery
 
-@tracer.start_as_current_span(name="get_product_documents")
-def get_product_documents(messages: list, context: dict = None) -> dict:
-    if context is None:
-        context = {}
+SELECT_FIELDS = ["id", "content", "filepath", "title", "url"]
 
-    overrides = context.get("overrides", {})
-    top = overrides.get("top", 5)
+# shared by every session in this process; entries for an index are
+# invalidated when it is re-indexed (see retrieval_cache.bump_index_version)
+retrieval_cache = RetrievalCache()
 
-    # generate a search query from the chat messages
-    intent_prompty = PromptTemplate.from_prompty(Path(ASSET_PATH) / "intent_mapping.prompty")
 
-    intent_mapping_response = chat.complete(
-        model=os.environ["INTENT_MAPPING_MODEL"],
-        messages=intent_prompty.create_messages(conversation=messages),
-        **intent_prompty.parameters,
-    )
-
-    # the search_query returned here will be a stringified JSON object
-    search_query = intent_mapping_response.choices[0].message.content
-    logger.debug(f"🧠 Intent mapping: {search_query}")
+def search_documents(search_query: str, budget: dict, filters: str = None) -> list:
+    cache_key = retrieval_cache.key(index_name, search_query, filters, tuple(sorted(budget.items())))
+    documents = retrieval_cache.get(cache_key)
+    record_cache("retrieval", documents is not None)
+    if documents is not None:
+        logger.debug(f"♻️  Retrieval cache hit for '{search_query}'")
+        return documents
 
-    # -- OLD: generate a vector representation of the search query
-    # embedding = embeddings.embed(model=os.environ["EMBEDDINGS_MODEL"], input=search_query)
+    # generate a vector representation of the search query
+    search_vector = query_embedder.embed(search_query, timeout=EMBED_QUERY_TIMEOUT)
 
-    # --- NEW: generate a vector representation of the search query
-    #  The intent mapping response is a stringied JSON object 
-    #   with the intent and search_query components. We need to
-    #   extract the search_query term and create embedding from it
-    import json
-    intent_map = json.loads(search_query)
-    embedding = embeddings.embed(model=os.environ["EMBEDDINGS_MODEL"], input=intent_map["search_query"])
-    search_vector = embedding.data[0].embedding
-    # --- END
+    # search the index for products matching the search query; adaptive mode
+    # trims the list at the first large score gap and only runs a deeper
+    # search when the first page is inconclusive
+    def search(top: int) -> list:
+        vector_query = VectorizedQuery(vector=search_vector, k_nearest_neighbors=top, fields="contentVector")
+        return search_client.search(
+            search_text=search_query, vector_queries=[vector_query], filter=filters, select=SELECT_FIELDS, top=top
+        )
 
-    # search the index for products matching the search query
-    vector_query = VectorizedQuery(vector=search_vector, k_nearest_neighbors=top, fields="contentVector")
+    with stage("retrieval"):
+        search_results = adaptive_search(search, budget)
 
-    search_results = search_client.search(
-        search_text=search_query, vector_queries=[vector_query], select=["id", "content", "filepath", "title", "url"]
-    )
+        # keep the first occurrence of each document id
+        documents = {}
+        for result in search_results:
+            if result["id"] not in documents:
+                documents[result["id"]] = {field: result[field] for field in SELECT_FIELDS}
+        documents = list(documents.values())
 
-    documents = [
-        {
-            "id": result["id"],
-            "content": result["content"],
-            "filepath": result["filepath"],
-            "title": result["title"],
-            "url": result["url"],
-        }
-        for result in search_results
-    ]
-
-    # add results to the provided context
-    if "thoughts" not in context:
-        context["thoughts"] = []
-
-    # add thoughts and documents to the context object so it can be returned to the caller
-    context["thoughts"].append(
-        {
-            "title": "Generated search query",
-            "description": search_query,
-        }
-    )
+    retrieval_cache.set(cache_key, documents)
+    return documents
 
-    if "grounding_data" not in context:
-        context["grounding_data"] = []
-    context["grounding_data"].append(documents)
 
-    logger.debug(f"📄 {len(documents)} documents retrieved: {documents}")
+def get_grounding_documents(context: dict) -> list:
+    """Resolve the document ids stored in context["grounding_data"] lazily."""
+    documents = []
+    for doc_id in context.get("grounding_data", []):
+        doc = retrieval_cache.get_document(index_name, doc_id)
+        if doc is None:
+            doc = search_client.get_document(key=doc_id, selected_fields=SELECT_FIELDS)
+            retrieval_cache.set_document(index_name, doc)
+        documents.append(doc)
     return documents
 
 
+@tracer.start_as_current_span(name="get_product_documents")
+def get_product_documents(messages: list, context: dict = None) -> dict:
+    if context is None:
+        context = {}
+
+    # one structured record per call in the request log (tokens, cost,
+    # stage timings and cache hits); see request_log.py
+    with request_context("product_search", user=context.get("session_id"), index=index_name) as request:
+        context["trace_id"] = request.data["trace_id"]
+
+        overrides = context.get("overrides", {})
+        budget = retrieval_budget(overrides)
+        filters = overrides.get("filter")
+
+        # generate a search query from the chat messages
+        intent_prompty = PromptTemplate.from_prompty(Path(ASSET_PATH) / "intent_mapping.prompty")
+
+        intent_messages = intent_prompty.create_messages(conversation=messages)
+        intent_mapping_response = chat_router.call(
+            lambda chat, model: chat.complete(model=model, messages=intent_messages, **intent_prompty.parameters),
+            tokens=estimate_tokens(intent_messages) + intent_prompty.parameters.get("max_tokens", 500),
+            session_id=context.get("session_id"),
+        )
+
+        # the search_query returned here will be a stringified JSON object
+        search_query = intent_mapping_response.choices[0].message.content
+        logger.debug(f"🧠 Intent mapping: {search_query}")
+
+        # The intent mapping response is a stringied JSON object
+        #   with the intent and search_query components. We need to
+        #   extract the search_query term and search with it
+        import json
+        intent_map = json.loads(search_query)
+        documents = search_documents(intent_map["search_query"], budget, filters)
+
+        # add results to the provided context
+        if "thoughts" not in context:
+            context["thoughts"] = []
+
+        # add thoughts and documents to the context object so it can be returned to the caller
+        context["thoughts"].append(
+            {
+                "title": "Generated search query",
+                "description": search_query,
+            }
+        )
+
+        # grounding data only keeps document ids, deduplicated across turns;
+        # use get_grounding_documents(context) to load their content
+        if "grounding_data" not in context:
+            context["grounding_data"] = []
+        seen = set(context["grounding_data"])
+        context["grounding_data"].extend(doc["id"] for doc in documents if doc["id"] not in seen)
+
+        request.update(documents=len(documents))
+        logger.debug(f"📄 {len(documents)} documents retrieved: {documents}")
+        return documents
+
+
 # ----------------------------------------------
 # 3. Run Function To Test Capability from CLI
 # ----------------------------------------------
@@ -143,8 +192,8 @@ if __name__ == "__main__":
 # ----------------------------------------------------------
 # To test:
 #  - make sure `assets/intent_mapping.prompty` exists
-#  - run as: 
-#     python get_product_documents.py 
+#  - run from the repository root as: 
+#     python -m utilities.get_product_documents 
 #        --query "I need a new tent for 4 people, what would you recommend?"
 # ----------------------------------------------------------
 # Response Looks Something Like:
@@ -19,12 +19,10 @@ def list_search_indexes():
     client = SearchIndexClient(
         endpoint=service_endpoint, credential=AzureKeyCredential(api_key)
     )
-    indexes = client.list_indexes()
-
-    print("Available search indexes:")
-    for index in indexes:
-        print(index.name)
+    return list(client.list_index_names())
 
 
 if __name__ == "__main__":
-    list_search_indexes()
+    print("Available search indexes:")
+    for name in list_search_indexes():
+        print(name)
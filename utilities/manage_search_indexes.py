@@ -0,0 +1,111 @@
+import fnmatch
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex
+from dotenv import load_dotenv
+
+from utilities.delete_search_index import delete_search_index, get_search_index_client
+
+load_dotenv()
+
+MAX_CONCURRENCY = int(os.getenv("INDEX_ADMIN_CONCURRENCY", "8"))
+
+
+def _run_concurrently(fn: Callable[[str], dict], names: list[str], concurrency: int) -> list[dict]:
+    def safe(name: str) -> dict:
+        try:
+            return {"name": name, "ok": True, **fn(name)}
+        except Exception as e:
+            return {"name": name, "ok": False, "error": str(e)}
+
+    # one shared client; the pool bounds how many requests are in flight
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(safe, names))
+
+
+def match_index_names(client: SearchIndexClient, pattern: str = "*") -> list[str]:
+    return sorted(name for name in client.list_index_names() if fnmatch.fnmatchcase(name, pattern))
+
+
+def list_indexes(client: SearchIndexClient, pattern: str = "*", concurrency: int = MAX_CONCURRENCY) -> list[dict]:
+    def stats(name: str) -> dict:
+        statistics = client.get_index_statistics(name)
+        return {
+            "document_count": statistics.get("document_count"),
+            "storage_size": statistics.get("storage_size"),
+            "vector_index_size": statistics.get("vector_index_size"),
+        }
+
+    return _run_concurrently(stats, match_index_names(client, pattern), concurrency)
+
+
+def delete_indexes(
+    client: SearchIndexClient, pattern: str, dry_run: bool = False, concurrency: int = MAX_CONCURRENCY
+) -> list[dict]:
+    names = match_index_names(client, pattern)
+    if dry_run:
+        return [{"name": name, "ok": True, "deleted": False} for name in names]
+    return _run_concurrently(
+        lambda name: {"deleted": bool(delete_search_index(name, client))}, names, concurrency
+    )
+
+
+def create_indexes(
+    client: SearchIndexClient, schema_file: str, names: list[str] = None, concurrency: int = MAX_CONCURRENCY
+) -> list[dict]:
+    """
+    Create indexes from a JSON schema file in the REST API format. The file may
+    hold a single definition (created once per name in `names`, or under its own
+    name) or a list of definitions.
+    """
+    with open(schema_file) as f:
+        schema = json.load(f)
+    definitions = schema if isinstance(schema, list) else [schema]
+    if names:
+        if len(definitions) != 1:
+            raise ValueError("--name can only be used with a single-index schema file")
+        definitions = [{**definitions[0], "name": name} for name in names]
+    by_name = {definition["name"]: definition for definition in definitions}
+
+    def create(name: str) -> dict:
+        index = client.create_or_update_index(SearchIndex.from_dict(by_name[name]))
+        return {"fields": len(index.fields)}
+
+    return _run_concurrently(create, list(by_name), concurrency)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage Azure AI Search indexes in bulk")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY, help="max parallel requests")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list indexes with document count and storage size")
+    list_parser.add_argument("--pattern", type=str, default="*", help="glob pattern, e.g. 'tenant-*'")
+
+    delete_parser = subparsers.add_parser("delete", help="delete every index matching a pattern")
+    delete_parser.add_argument("--pattern", type=str, required=True, help="glob pattern, e.g. 'tenant-*'")
+    delete_parser.add_argument("--dry-run", action="store_true", help="only show what would be deleted")
+
+    create_parser = subparsers.add_parser("create", help="create indexes from a JSON schema file")
+    create_parser.add_argument("--schema", type=str, required=True, help="path to the index schema JSON")
+    create_parser.add_argument("--name", nargs="+", help="index names to create from a single schema")
+
+    args = parser.parse_args()
+    client = get_search_index_client()
+
+    if args.command == "list":
+        results = list_indexes(client, args.pattern, args.concurrency)
+    elif args.command == "delete":
+        results = delete_indexes(client, args.pattern, args.dry_run, args.concurrency)
+    else:
+        results = create_indexes(client, args.schema, args.name, args.concurrency)
+
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
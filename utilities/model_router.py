@@ -0,0 +1,256 @@
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable
+from urllib.parse import urlparse
+
+from azure.ai.inference import ChatCompletionsClient, EmbeddingsClient
+from azure.ai.projects import AIProjectClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from azure.identity import DefaultAzureCredential
+
+from utilities.admission import admission_controller
+from utilities.config import get_logger
+from utilities.request_log import record_model_call, record_timing
+
+logger = get_logger(__name__)
+
+CIRCUIT_BASE_COOLDOWN = float(os.getenv("CIRCUIT_BASE_COOLDOWN", "5"))
+CIRCUIT_MAX_COOLDOWN = float(os.getenv("CIRCUIT_MAX_COOLDOWN", "120"))
+PROBE_POLL_INTERVAL = 0.25
+# Peso de la última medición en la media móvil de latencia
+LATENCY_EWMA_ALPHA = 0.3
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ServiceRequestError):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code == 429 or (error.status_code or 0) >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "Retry-After"):
+        value = headers.get(header)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+
+class Endpoint:
+    def __init__(self, model: str, client_factory: Callable[[], Any], name: str = None):
+        self.model = model
+        self.name = name or model
+        self._client_factory = client_factory
+        self._client = None
+        self.outstanding_tokens = 0
+        self.latency = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    def available(self, now: float) -> bool:
+        # Circuito abierto: no se usa hasta que pase el cooldown; luego se
+        # permite una sola petición de prueba (half-open)
+        if self.failures == 0:
+            return True
+        return now >= self.open_until and not self.probing
+
+
+class ModelRouter:
+    """
+    Reparte las llamadas entre varios deployments del mismo modelo eligiendo
+    el de menos tokens en curso, y hace failover con circuit breaker ante
+    429, 5xx o errores de red.
+    """
+
+    def __init__(self, endpoints: list[Endpoint]):
+        if not endpoints:
+            raise ValueError("ModelRouter necesita al menos un deployment")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def _pick(self, exclude: set) -> Endpoint | None:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                e for e in self.endpoints if e.name not in exclude and e.available(now)
+            ]
+            if not candidates:
+                return None
+            endpoint = min(
+                candidates, key=lambda e: (e.outstanding_tokens, e.latency or 0.0)
+            )
+            if endpoint.failures:
+                endpoint.probing = True
+            return endpoint
+
+    def _time_to_available(self, exclude: set) -> float:
+        now = time.monotonic()
+        with self._lock:
+            waits = [
+                # Durante una prueba half-open se consulta de nuevo en breve
+                PROBE_POLL_INTERVAL if e.probing else max(0.0, e.open_until - now)
+                for e in self.endpoints
+                if e.name not in exclude
+            ]
+        return max(min(waits, default=PROBE_POLL_INTERVAL), 0.01)
+
+    def _record_success(self, endpoint: Endpoint, latency: float):
+        with self._lock:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += LATENCY_EWMA_ALPHA * (latency - endpoint.latency)
+            endpoint.failures = 0
+            endpoint.probing = False
+
+    def _record_failure(self, endpoint: Endpoint, error: Exception):
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.probing = False
+            cooldown = _retry_after(error) or min(
+                CIRCUIT_MAX_COOLDOWN, CIRCUIT_BASE_COOLDOWN * 2 ** (endpoint.failures - 1)
+            )
+            endpoint.open_until = time.monotonic() + cooldown
+        logger.warning(
+            f"⚠️  Deployment '{endpoint.name}' falló ({error}); circuito abierto {cooldown:.0f}s"
+        )
+
+    def call(
+        self,
+        fn: Callable[[Any, str], Any],
+        tokens: int = 1,
+        session_id: str = None,
+        on_wait: Callable[[int], None] = None,
+    ):
+        """Ejecuta `fn(client, model)` en el mejor deployment disponible."""
+        tried = set()
+        last_error = None
+        deadline = time.monotonic() + admission_controller.timeout
+        while True:
+            endpoint = self._pick(tried)
+            if endpoint is None:
+                # Todos con el circuito abierto (o ya probados en esta llamada):
+                # esperar a que alguno salga del cooldown, como mucho hasta
+                # agotar el tiempo de admisión, en lugar de fallar al instante
+                if len(tried) == len(self.endpoints):
+                    tried.clear()
+                wait = self._time_to_available(tried)
+                if time.monotonic() + wait > deadline:
+                    if last_error is not None:
+                        raise last_error
+                    raise RuntimeError("Ningún deployment disponible en este momento.")
+                time.sleep(wait)
+                continue
+            tried.add(endpoint.name)
+
+            with self._lock:
+                endpoint.outstanding_tokens += tokens
+            try:
+                queued = time.perf_counter()
+                with admission_controller.admit(
+                    endpoint.name, session_id=session_id, tokens=tokens, on_wait=on_wait
+                ):
+                    started = time.perf_counter()
+                    record_timing("queue", started - queued)
+                    result = fn(endpoint.client, endpoint.model)
+                latency = time.perf_counter() - started
+                self._record_success(endpoint, latency)
+                # Tokens reales (campo `usage` del SDK), coste y latencia en
+                # el registro de la petición en curso
+                record_model_call(endpoint.model, latency, getattr(result, "usage", None))
+                return result
+            except Exception as e:
+                if not _is_retryable(e):
+                    with self._lock:
+                        endpoint.probing = False
+                    raise
+                self._record_failure(endpoint, e)
+                last_error = e
+            finally:
+                with self._lock:
+                    endpoint.outstanding_tokens -= tokens
+
+
+@functools.lru_cache(maxsize=None)
+def _project_client(kind: str):
+    # Un único cliente por tipo para todos los deployments del proyecto
+    project = AIProjectClient.from_connection_string(
+        conn_str=os.environ["AIPROJECT_CONNECTION_STRING"],
+        credential=DefaultAzureCredential(),
+    )
+    if kind == "embeddings":
+        return project.inference.get_embeddings_client()
+    return project.inference.get_chat_completions_client()
+
+
+def _endpoint_client_factory(kind: str, url: str, api_key_env: str = None):
+    def factory():
+        client_class = EmbeddingsClient if kind == "embeddings" else ChatCompletionsClient
+        if api_key_env:
+            return client_class(endpoint=url, credential=AzureKeyCredential(os.environ[api_key_env]))
+        return client_class(
+            endpoint=url,
+            credential=DefaultAzureCredential(),
+            credential_scopes=["https://cognitiveservices.azure.com/.default"],
+        )
+
+    return factory
+
+
+def load_endpoints(model_env: str, kind: str) -> list[Endpoint]:
+    """
+    Lee `<model_env>_DEPLOYMENTS`: una lista separada por comas de deployments
+    del proyecto, o un JSON con objetos {"model", "endpoint", "api_key_env",
+    "rpm", "tpm"} para deployments en otros recursos o regiones. Sin esa
+    variable se usa el deployment único de `<model_env>`.
+    """
+    raw = os.getenv(f"{model_env}_DEPLOYMENTS", "").strip()
+    if not raw:
+        entries = [{"model": os.environ[model_env]}]
+    elif raw.startswith("["):
+        entries = json.loads(raw)
+    else:
+        entries = [{"model": name.strip()} for name in raw.split(",") if name.strip()]
+
+    endpoints = []
+    for entry in entries:
+        if entry.get("endpoint"):
+            name = f"{entry['model']}@{urlparse(entry['endpoint']).netloc}"
+            factory = _endpoint_client_factory(kind, entry["endpoint"], entry.get("api_key_env"))
+        else:
+            name = entry["model"]
+            factory = functools.partial(_project_client, kind)
+        if entry.get("rpm") or entry.get("tpm"):
+            admission_controller.configure(name, entry.get("rpm"), entry.get("tpm"))
+        endpoints.append(Endpoint(entry["model"], factory, name=name))
+    return endpoints
+
+
+_routers: dict[str, ModelRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(model_env: str, kind: str = "chat") -> ModelRouter:
+    """Router compartido por proceso para el modelo configurado en `model_env`."""
+    with _routers_lock:
+        if model_env not in _routers:
+            _routers[model_env] = ModelRouter(load_endpoints(model_env, kind))
+        return _routers[model_env]
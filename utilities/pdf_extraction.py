@@ -0,0 +1,333 @@
+import gc
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import fitz  # PyMuPDF
+import psutil
+from utilities.config import get_logger
+
+logger = get_logger(__name__)
+
+# Se incrementa cuando cambia la forma de extraer, para invalidar la caché
+EXTRACTION_VERSION = "2"
+
+OCR_LANGUAGE = os.getenv("PDF_OCR_LANGUAGE", "spa+eng")
+OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+# Una página se considera escaneada si casi no tiene texto y las imágenes
+# cubren al menos esta fracción de su superficie
+MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "20"))
+IMAGE_PAGE_COVERAGE = float(os.getenv("PDF_IMAGE_PAGE_COVERAGE", "0.5"))
+
+# Tamaño de los fragmentos que se indexan, en caracteres
+CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", "2000"))
+CHUNK_OVERLAP = int(os.getenv("PDF_CHUNK_OVERLAP", "200"))
+
+# Procesamiento por ventanas de páginas para PDFs muy grandes: cuántas páginas
+# se extraen a la vez, cuántas ventanas pueden esperar a ser indexadas y el
+# tope de memoria (RSS) a partir del cual la extracción se detiene
+WINDOW_PAGES = int(os.getenv("PDF_WINDOW_PAGES", "50"))
+PIPELINE_DEPTH = int(os.getenv("PDF_PIPELINE_DEPTH", "2"))
+MEMORY_CEILING_MB = int(os.getenv("PDF_MEMORY_CEILING_MB", "1024"))
+
+CACHE_DIR = Path(
+    os.getenv(
+        "PDF_EXTRACTION_CACHE_DIR",
+        Path(tempfile.gettempdir()) / "pdf_extraction_cache",
+    )
+)
+# Límites de la caché: se purgan las páginas sin usar desde hace más de
+# CACHE_MAX_AGE_HOURS y, si aun así se pasa de CACHE_MAX_MB, las más antiguas
+CACHE_MAX_AGE_HOURS = float(os.getenv("PDF_EXTRACTION_CACHE_MAX_AGE_HOURS", "168"))
+CACHE_MAX_MB = float(os.getenv("PDF_EXTRACTION_CACHE_MAX_MB", "512"))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _page_hash(file_hash: str, page_number: int) -> str:
+    # Clave por archivo completo y número de página: el contenido de una
+    # página depende también de fuentes y XObjects compartidos, así que
+    # hashear solo su stream puede confundir páginas de PDFs distintos
+    key = f"{EXTRACTION_VERSION}|{OCR_LANGUAGE}|{OCR_DPI}|{file_hash}|{page_number}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _read_cache(page_hash: str) -> str | None:
+    path = CACHE_DIR / f"{page_hash}.json"
+    try:
+        text = json.loads(path.read_text(encoding="utf-8"))["text"]
+    except (OSError, ValueError, KeyError):
+        return None
+    # La fecha de modificación marca el último uso para la purga
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return text
+
+
+def _write_cache(page_hash: str, text: str):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = CACHE_DIR / f"{page_hash}.json"
+        path.write_text(json.dumps({"text": text}, ensure_ascii=False), encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"⚠️  No se pudo escribir la caché de extracción: {e}")
+
+
+def purge_cache(
+    cache_dir: Path = CACHE_DIR,
+    max_age_hours: float = CACHE_MAX_AGE_HOURS,
+    max_mb: float = CACHE_MAX_MB,
+):
+    """Elimina las páginas en caché caducadas y las más antiguas por encima de `max_mb`."""
+    cutoff = time.time() - max_age_hours * 3600
+    entries = []
+    for path in Path(cache_dir).glob("*.json"):
+        try:
+            stat = path.stat()
+            if stat.st_mtime < cutoff:
+                path.unlink()
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            continue
+
+    excess = sum(size for _, size, _ in entries) - max_mb * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if excess <= 0:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        excess -= size
+
+
+def _is_image_only(page: fitz.Page) -> bool:
+    if len(page.get_text().strip()) >= MIN_TEXT_CHARS:
+        return False
+    page_area = page.rect.get_area()
+    if not page_area:
+        return False
+    image_area = sum(fitz.Rect(info["bbox"]).get_area() for info in page.get_image_info())
+    return image_area / page_area >= IMAGE_PAGE_COVERAGE
+
+
+def _extract_layout_text(page: fitz.Page) -> str:
+    items = []
+
+    # find_tables solo detecta tablas con líneas; se omite si la página no
+    # tiene dibujos vectoriales para no penalizar las páginas de solo texto
+    table_rects = []
+    if page.get_cdrawings():
+        for table in page.find_tables().tables:
+            rect = fitz.Rect(table.bbox)
+            table_rects.append(rect)
+            items.append((rect.y0, rect.x0, table.to_markdown().strip()))
+
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks", sort=True):
+        text = text.strip()
+        if block_type != 0 or not text:
+            continue
+        rect = fitz.Rect(x0, y0, x1, y1)
+        area = rect.get_area()
+        if any(area and (rect & table).get_area() > 0.5 * area for table in table_rects):
+            continue
+        items.append((y0, x0, text))
+
+    items.sort(key=lambda item: (round(item[0]), item[1]))
+    return "\n\n".join(text for _, _, text in items)
+
+
+def _ocr_page(pdf_path: str, page_number: int) -> str:
+    with fitz.open(pdf_path) as doc:
+        page = doc[page_number]
+        textpage = page.get_textpage_ocr(language=OCR_LANGUAGE, dpi=OCR_DPI, full=True)
+        return page.get_text(textpage=textpage, sort=True).strip()
+
+
+def _ocr_pages(pool: ProcessPoolExecutor, pdf_path: str, pending: dict[int, str]) -> dict[int, str]:
+    results = {}
+    futures = {
+        page_number: pool.submit(_ocr_page, pdf_path, page_number)
+        for page_number in pending
+    }
+    for page_number, future in futures.items():
+        try:
+            text = future.result()
+        except Exception as e:
+            logger.warning(f"⚠️  OCR falló en la página {page_number + 1}: {e}")
+            results[page_number] = ""
+            continue
+        _write_cache(pending[page_number], text)
+        results[page_number] = text
+    return results
+
+
+class _OcrPool:
+    # El pool de OCR se crea solo si aparece alguna página escaneada y se
+    # reutiliza en todas las ventanas del documento
+    def __init__(self):
+        self._pool = None
+
+    def get(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # "spawn" evita heredar los hilos del servidor de Streamlit
+            self._pool = ProcessPoolExecutor(
+                max_workers=max(1, OCR_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+
+def _extract_window(
+    pdf_path: str, file_hash: str, start: int, end: int, ocr_pool: _OcrPool
+) -> list[str]:
+    pages: list[str] = []
+    pending: dict[int, str] = {}
+
+    with fitz.open(pdf_path) as doc:
+        for page_number in range(start, end):
+            page = doc[page_number]
+            page_hash = _page_hash(file_hash, page_number)
+            cached = _read_cache(page_hash)
+            if cached is not None:
+                pages.append(cached)
+            elif _is_image_only(page):
+                pending[page_number] = page_hash
+                pages.append("")
+            else:
+                text = _extract_layout_text(page)
+                _write_cache(page_hash, text)
+                pages.append(text)
+            del page
+    # Liberar la caché de recursos de MuPDF (fuentes, imágenes) de la ventana
+    fitz.TOOLS.store_shrink(100)
+
+    if pending:
+        logger.info(f"🔎 Aplicando OCR a {len(pending)} página(s) escaneada(s)")
+        for page_number, text in _ocr_pages(ocr_pool.get(), pdf_path, pending).items():
+            pages[page_number - start] = text
+
+    return pages
+
+
+def memory_mb() -> float:
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+_DONE = object()
+
+
+def iter_pdf_windows(
+    pdf_path: str, start_page: int = 0, window_pages: int = WINDOW_PAGES
+) -> Iterator[tuple[int, list[str]]]:
+    """
+    Extrae el PDF por ventanas de `window_pages` páginas en un hilo aparte y
+    devuelve (primera página, textos) de cada ventana en orden. Como mucho
+    PIPELINE_DEPTH ventanas esperan a ser consumidas, y la extracción se
+    frena mientras la memoria supere MEMORY_CEILING_MB.
+    """
+    total = page_count(pdf_path)
+    file_hash = file_sha256(pdf_path)
+    purge_cache()
+    windows: queue.Queue = queue.Queue(maxsize=max(1, PIPELINE_DEPTH))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                windows.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        ocr_pool = _OcrPool()
+        try:
+            for start in range(start_page, total, window_pages):
+                # Contrapresión: esperar a que se consuman las ventanas
+                # pendientes antes de extraer más
+                if memory_mb() > MEMORY_CEILING_MB:
+                    gc.collect()
+                    while memory_mb() > MEMORY_CEILING_MB and not windows.empty():
+                        if stop.is_set():
+                            return
+                        time.sleep(0.2)
+                pages = _extract_window(
+                    pdf_path, file_hash, start, min(start + window_pages, total), ocr_pool
+                )
+                if not put((start, pages)):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+        finally:
+            ocr_pool.shutdown()
+
+    producer = threading.Thread(target=produce, name="pdf-extraction", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = windows.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def extract_pdf_pages(pdf_path: str) -> list[str]:
+    """
+    Extrae el texto de cada página en orden de lectura, con las tablas en Markdown.
+    Las páginas escaneadas se envían a OCR en paralelo; los resultados se guardan
+    en caché por hash del archivo y número de página.
+    """
+    return [text for _, pages in iter_pdf_windows(pdf_path) for text in pages]
+
+
+def chunk_page(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """Divide el texto de una página en fragmentos, cortando entre párrafos si es posible."""
+    text = text.strip()
+    chunks = []
+    while len(text) > size:
+        cut = text.rfind("\n\n", overlap + 1, size)
+        if cut == -1:
+            cut = text.rfind(" ", overlap + 1, size)
+        if cut == -1:
+            cut = size
+        chunks.append(text[:cut].strip())
+        text = text[cut - overlap :].strip()
+    if text:
+        chunks.append(text)
+    return chunks
@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+# Máximo que una consulta espera a una recuperación anticipada ya en curso
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "10"))
+
+
+class Prefetcher:
+    """
+    Ejecuta recuperaciones anticipadas en segundo plano. Cada tarea se registra
+    por clave mientras está en curso para que una consulta igual la reutilice
+    en lugar de repetir la búsqueda; al programar una nueva ronda para una
+    sesión se cancelan las tareas pendientes de la ronda anterior.
+    """
+
+    def __init__(self, workers: int = PREFETCH_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, Future] = {}
+        self._rounds: dict[str, list[Future]] = {}
+        # Una tarea compartida (misma clave) pertenece a varias sesiones y solo
+        # se cancela cuando ninguna la necesita ya
+        self._owners: dict[Future, set[str]] = {}
+        self._suggestions: dict[str, list[str]] = {}
+
+    def submit(self, key: Hashable, fn: Callable, *args, session_id: str = None) -> Future:
+        with self._lock:
+            future = self._inflight.get(key)
+            created = future is None or future.cancelled()
+            if created:
+                future = self._pool.submit(fn, *args)
+                self._inflight[key] = future
+            if session_id is not None:
+                self._rounds.setdefault(session_id, []).append(future)
+                self._owners.setdefault(future, set()).add(session_id)
+        # Fuera del lock: si la tarea ya terminó, el callback se ejecuta aquí
+        # mismo y _forget vuelve a tomarlo
+        if created:
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key: Hashable, future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            self._owners.pop(future, None)
+
+    def inflight(self, key: Hashable) -> Future | None:
+        """
+        Tarea ya en ejecución (o terminada) para `key`. Si aún está en cola se
+        cancela y se devuelve None: esperarla costaría más que buscar ya.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is None:
+            return None
+        # cancel() falla si la tarea ya arrancó; en ese caso se reutiliza.
+        # Va fuera del lock porque dispara _forget, que también lo toma
+        if not future.done() and future.cancel():
+            return None
+        if future.cancelled():
+            return None
+        return future
+
+    def new_round(self, session_id: str):
+        """Cancela lo que quede pendiente de la ronda anterior de la sesión."""
+        with self._lock:
+            stale = []
+            for future in self._rounds.pop(session_id, []):
+                owners = self._owners.get(future)
+                if owners is not None:
+                    owners.discard(session_id)
+                    if owners:
+                        continue
+                stale.append(future)
+            self._suggestions.pop(session_id, None)
+        for future in stale:
+            future.cancel()
+
+    def set_suggestions(self, session_id: str, queries: list[str]):
+        with self._lock:
+            self._suggestions[session_id] = queries
+
+    def suggestions(self, session_id: str) -> list[str]:
+        with self._lock:
+            return list(self._suggestions.get(session_id, []))
+
+
+# Compartido por todas las sesiones de Streamlit del proceso
+prefetcher = Prefetcher()
@@ -0,0 +1,136 @@
+import io
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+PRODUCT_BATCH_SIZE = int(os.getenv("PRODUCT_BATCH_SIZE", "1000"))
+
+# column types expected by the product index (see create_product_index_definition)
+PRODUCT_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("name", pa.string()),
+        ("price", pa.float64()),
+        ("category", pa.string()),
+        ("brand", pa.string()),
+        ("description", pa.string()),
+        ("quantity", pa.int32()),
+    ]
+)
+
+
+def _read_csv(path: str, batch_size: int) -> Iterator[pa.RecordBatch]:
+    # read every column as text so ids like "007" keep their leading zeros;
+    # types are coerced per column afterwards
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=1 << 20),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={field.name: pa.string() for field in PRODUCT_SCHEMA}
+        ),
+    )
+    for batch in reader:
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+def _as_text(value) -> str | None:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def _text_batch(lines: list[bytes]) -> pa.RecordBatch:
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON line in product catalog: {e}") from e
+    return pa.RecordBatch.from_pydict(
+        {
+            name: pa.array([_as_text(record.get(name)) for record in records], type=pa.string())
+            for name in PRODUCT_SCHEMA.names
+        }
+    )
+
+
+def _read_ndjson(path: str, batch_size: int) -> Iterator[pa.RecordBatch]:
+    def parse(lines: list[bytes]) -> Iterator[pa.RecordBatch]:
+        try:
+            table = pa_json.read_json(io.BytesIO(b"".join(lines)))
+        except pa.ArrowInvalid:
+            # a column changes type between lines (e.g. "id": 1 and "id": "x2"),
+            # which type inference rejects; read the chunk as text and let
+            # coerce_batch cast it like the CSV columns
+            yield _text_batch(lines)
+            return
+        yield from table.to_batches()
+
+    lines = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            lines.append(line if line.endswith(b"\n") else line + b"\n")
+            if len(lines) >= batch_size:
+                yield from parse(lines)
+                lines = []
+    if lines:
+        yield from parse(lines)
+
+
+def _read_parquet(path: str, batch_size: int) -> Iterator[pa.RecordBatch]:
+    parquet_file = pq.ParquetFile(path)
+    columns = [name for name in PRODUCT_SCHEMA.names if name in parquet_file.schema_arrow.names]
+    yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def read_record_batches(path: str, batch_size: int = PRODUCT_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    suffix = Path(path).suffix.lower()
+    if suffix == ".parquet":
+        return _read_parquet(path, batch_size)
+    if suffix in (".ndjson", ".jsonl"):
+        return _read_ndjson(path, batch_size)
+    if suffix == ".csv":
+        return _read_csv(path, batch_size)
+    raise ValueError(f"Unsupported product catalog format: '{suffix}'")
+
+
+def coerce_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Cast every column to PRODUCT_SCHEMA and drop rows without an id."""
+    columns = []
+    for field in PRODUCT_SCHEMA:
+        if field.name not in batch.schema.names:
+            columns.append(pa.nulls(batch.num_rows, type=field.type))
+            continue
+        column = batch.column(field.name)
+        if pa.types.is_string(column.type) and not pa.types.is_string(field.type):
+            column = pc.utf8_trim_whitespace(column)
+            # empty cells become nulls instead of failing the cast
+            column = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+        try:
+            columns.append(pc.cast(column, field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Invalid values in product column '{field.name}': {e}") from e
+    coerced = pa.RecordBatch.from_arrays(columns, schema=PRODUCT_SCHEMA)
+    # null lengths (missing ids) are dropped by filter as well
+    return coerced.filter(pc.greater(pc.utf8_length(coerced.column("id")), 0))
+
+
+def iter_product_batches(path: str, batch_size: int = PRODUCT_BATCH_SIZE) -> Iterator[list[dict]]:
+    """
+    Lazily yield upload-ready lists of product documents from a CSV, NDJSON
+    or Parquet catalog. Only one record batch is materialised at a time.
+    """
+    for batch in read_record_batches(path, batch_size):
+        coerced = coerce_batch(batch)
+        if coerced.num_rows:
+            yield coerced.to_pylist()
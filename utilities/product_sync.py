@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import requests
+
+SYNC_DELETE_BATCH_SIZE = int(os.getenv("SYNC_DELETE_BATCH_SIZE", "1000"))
+# index aliases are only exposed by the preview REST API
+ALIAS_API_VERSION = os.getenv("SEARCH_ALIAS_API_VERSION", "2024-05-01-preview")
+
+
+def row_hash(doc: dict) -> str:
+    payload = json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path: str) -> dict[str, str]:
+    try:
+        with open(path) as f:
+            return json.load(f)["rows"]
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(path: str, rows: dict[str, str]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"rows": rows}, f)
+    tmp.replace(path)
+
+
+def diff_catalog(
+    batches: Iterable[list[dict]], manifest: dict[str, str], new_manifest: dict[str, str]
+) -> Iterator[tuple[str, list]]:
+    """
+    Compare a catalog snapshot with the manifest of the last sync. Yields
+    ("upsert", docs) for new or changed rows as the snapshot streams in, then
+    ("delete", ids) for ids that disappeared. `new_manifest` is filled with
+    the row hashes of the snapshot; save it only once every change is applied.
+    """
+    for docs in batches:
+        changed = []
+        for doc in docs:
+            digest = row_hash(doc)
+            new_manifest[doc["id"]] = digest
+            if manifest.get(doc["id"]) != digest:
+                changed.append(doc)
+        if changed:
+            yield "upsert", changed
+
+    deleted = [doc_id for doc_id in manifest if doc_id not in new_manifest]
+    for start in range(0, len(deleted), SYNC_DELETE_BATCH_SIZE):
+        yield "delete", deleted[start : start + SYNC_DELETE_BATCH_SIZE]
+
+
+def _alias_url(endpoint: str, alias: str) -> str:
+    return f"{endpoint.rstrip('/')}/aliases/{alias}?api-version={ALIAS_API_VERSION}"
+
+
+def get_alias_index(endpoint: str, api_key: str, alias: str) -> str | None:
+    response = requests.get(_alias_url(endpoint, alias), headers={"api-key": api_key}, timeout=30)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()["indexes"][0]
+
+
+def point_alias(endpoint: str, api_key: str, alias: str, index_name: str):
+    response = requests.put(
+        _alias_url(endpoint, alias),
+        headers={"api-key": api_key, "Content-Type": "application/json"},
+        json={"name": alias, "indexes": [index_name]},
+        timeout=30,
+    )
+    response.raise_for_status()
@@ -0,0 +1,242 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+# Registro estructurado por petición (JSON lines), separado de los logs de
+# consola: una línea por consulta o indexación con tokens, coste y tiempos
+REQUEST_LOG_PATH = Path(
+    os.getenv("REQUEST_LOG_PATH", Path(tempfile.gettempdir()) / "request_logs" / "requests.jsonl")
+)
+# Fracción de peticiones que se escriben; las fallidas y las lentas siempre
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1.0"))
+REQUEST_LOG_SLOW_MS = float(os.getenv("REQUEST_LOG_SLOW_MS", "5000"))
+
+# Precio en USD por 1K tokens de cada deployment, p. ej.
+# '{"gpt-4o": {"prompt": 0.0025, "completion": 0.01}, "text-embedding-3-large": {"prompt": 0.00013}}'
+MODEL_PRICES = json.loads(os.getenv("MODEL_PRICES", "{}"))
+
+request_logger = logging.getLogger("app.requests")
+request_logger.setLevel(logging.INFO)
+# No se mezclan con los mensajes de consola del logger "app"
+request_logger.propagate = False
+
+_current: contextvars.ContextVar["RequestRecord | None"] = contextvars.ContextVar(
+    "request_record", default=None
+)
+_listener: logging.handlers.QueueListener | None = None
+_listener_lock = threading.Lock()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = getattr(record, "request", None)
+        if data is None:
+            data = {"level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Muestreo por cola: se decide al terminar la petición, así los errores y
+    las peticiones lentas se conservan siempre. Cada línea lleva su peso para
+    que el informe pueda extrapolar los totales.
+    """
+
+    def __init__(self, rate: float = REQUEST_LOG_SAMPLE_RATE, slow_ms: float = REQUEST_LOG_SLOW_MS):
+        super().__init__()
+        self.rate = rate
+        self.slow_ms = slow_ms
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        data = getattr(record, "request", None)
+        if data is None:
+            return True
+        if data.get("error") or data.get("latency_ms", 0) >= self.slow_ms or self.rate >= 1:
+            data["sample_weight"] = 1.0
+            return True
+        if random.random() < self.rate:
+            data["sample_weight"] = 1 / self.rate
+            return True
+        return False
+
+
+def configure_request_logging(path: Path = REQUEST_LOG_PATH):
+    """
+    Escribe los registros desde un hilo aparte (QueueHandler + QueueListener)
+    para que la petición no espere a la escritura en disco.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.FileHandler(path, encoding="utf-8")
+        file_handler.setFormatter(JsonLinesFormatter())
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(records)
+        queue_handler.addFilter(SamplingFilter())
+        request_logger.addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(records, file_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+    prices = MODEL_PRICES.get(model, {})
+    return (
+        prompt_tokens * prices.get("prompt", 0.0) + completion_tokens * prices.get("completion", 0.0)
+    ) / 1000
+
+
+class RequestRecord:
+    def __init__(self, kind: str, user: str = None, index: str = None, **fields):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.data = {
+            "trace_id": uuid.uuid4().hex,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "kind": kind,
+            "user": user or "anonymous",
+            "index": index,
+            "tokens": {"prompt": 0, "completion": 0, "embedding": 0},
+            "cost_usd": 0.0,
+            "models": {},
+            "stages_ms": {},
+            "cache": {},
+            **fields,
+        }
+
+    def add_timing(self, stage: str, seconds: float):
+        with self._lock:
+            stages = self.data["stages_ms"]
+            stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 2)
+
+    def add_usage(self, model: str, usage):
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        # Las respuestas de embeddings no traen completion_tokens
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens or 0)
+        with self._lock:
+            tokens = self.data["tokens"]
+            if completion_tokens is None:
+                tokens["embedding"] += prompt_tokens
+            else:
+                tokens["prompt"] += prompt_tokens
+                tokens["completion"] += completion_tokens
+            self.data["cost_usd"] = round(self.data["cost_usd"] + cost, 6)
+            calls = self.data["models"]
+            calls[model] = calls.get(model, 0) + 1
+
+    def add_cache(self, name: str, hit: bool):
+        with self._lock:
+            counts = self.data["cache"].setdefault(name, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def update(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+
+    def finish(self, error: BaseException = None):
+        self.data["latency_ms"] = round((time.perf_counter() - self._started) * 1000, 2)
+        if error is not None:
+            self.data["error"] = type(error).__name__
+        request_logger.info(self.data["kind"], extra={"request": self.data})
+
+
+@contextmanager
+def request_context(kind: str, user: str = None, index: str = None, **fields) -> Iterator[RequestRecord]:
+    """
+    Abre el registro de una petición. Las llamadas anidadas reutilizan el
+    registro en curso, así que una consulta genera una sola línea.
+    """
+    record = _current.get()
+    if record is not None:
+        yield record
+        return
+
+    configure_request_logging()
+    record = RequestRecord(kind, user=user, index=index, **fields)
+    token = _current.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.finish(error=e)
+        raise
+    else:
+        record.finish()
+    finally:
+        _current.reset(token)
+
+
+def current_request() -> RequestRecord | None:
+    return _current.get()
+
+
+def current_trace_id() -> str | None:
+    record = _current.get()
+    return record.data["trace_id"] if record else None
+
+
+@contextmanager
+def stage(name: str):
+    """Suma el tiempo del bloque a la etapa `name` de la petición en curso."""
+    record = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.add_timing(name, time.perf_counter() - started)
+
+
+def timed(iterable: Iterable, name: str) -> Iterator:
+    """Como `stage`, pero midiendo lo que se espera a cada elemento."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            with stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def record_timing(name: str, seconds: float):
+    record = _current.get()
+    if record is not None:
+        record.add_timing(name, seconds)
+
+
+def record_model_call(model: str, seconds: float, usage=None):
+    record = _current.get()
+    if record is None:
+        return
+    is_embedding = usage is not None and getattr(usage, "completion_tokens", None) is None
+    record.add_timing("embed" if is_embedding else "chat", seconds)
+    record.add_usage(model, usage)
+
+
+def record_cache(name: str, hit: bool):
+    record = _current.get()
+    if record is not None:
+        record.add_cache(name, hit)
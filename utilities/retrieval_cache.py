@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from cachetools import LRUCache, TTLCache
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "1024"))
+
+# Index versions live on disk so every process (Streamlit workers, CLI
+# scripts) sees a re-index and stops serving cached results for it
+INDEX_VERSION_DIR = Path(
+    os.getenv(
+        "INDEX_VERSION_DIR", Path(tempfile.gettempdir()) / "search_index_versions"
+    )
+)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def get_index_version(index_name: str) -> int:
+    try:
+        return int((INDEX_VERSION_DIR / index_name).read_text())
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_index_version(index_name: str) -> int:
+    version = get_index_version(index_name) + 1
+    INDEX_VERSION_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = INDEX_VERSION_DIR / f".{index_name}.{os.getpid()}.tmp"
+    tmp.write_text(str(version))
+    tmp.replace(INDEX_VERSION_DIR / index_name)
+    return version
+
+
+class RetrievalCache:
+    """
+    Bounded cache of search results keyed by normalised query, filters, top
+    and index version. Result lists only hold document ids; the documents
+    themselves are kept once in a separate LRU shared by all queries.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RETRIEVAL_CACHE_SIZE,
+        ttl: float = RETRIEVAL_CACHE_TTL,
+        document_maxsize: int = DOCUMENT_CACHE_SIZE,
+    ):
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._documents = LRUCache(maxsize=document_maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, index_name: str, query: str, filters=None, top: int = None) -> tuple:
+        return (
+            index_name,
+            get_index_version(index_name),
+            normalize_query(query),
+            json.dumps(filters, sort_keys=True, default=str),
+            top,
+        )
+
+    def get(self, key: tuple) -> list[dict] | None:
+        index_name, version = key[0], key[1]
+        with self._lock:
+            ids = self._results.get(key)
+            documents = None
+            if ids is not None:
+                documents = [self._documents.get((index_name, version, id_)) for id_ in ids]
+            if documents is None or any(doc is None for doc in documents):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return documents
+
+    def set(self, key: tuple, documents: list[dict]):
+        index_name, version = key[0], key[1]
+        with self._lock:
+            for doc in documents:
+                self._documents[(index_name, version, doc["id"])] = doc
+            self._results[key] = [doc["id"] for doc in documents]
+
+    def get_document(self, index_name: str, doc_id: str) -> dict | None:
+        with self._lock:
+            return self._documents.get((index_name, get_index_version(index_name), doc_id))
+
+    def set_document(self, index_name: str, doc: dict):
+        with self._lock:
+            self._documents[(index_name, get_index_version(index_name), doc["id"])] = doc
@@ -0,0 +1,206 @@
+# ----------------------------------------------
+# Recall vs. latency sweep for vector index settings
+#
+# Builds a temporary index for every combination of compression, truncated
+# dimensions and HNSW parameters, runs held-out query vectors against it and
+# compares the results with an exact kNN baseline computed locally with numpy.
+#
+# Run from the repo root:
+#    python -m utilities.vector_recall_sweep --source-index <index-name>
+# ----------------------------------------------
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.models import VectorizedQuery
+from dotenv import load_dotenv
+from utilities.config import get_logger
+from utilities.create_search_index import create_index_definition
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+UPLOAD_BATCH_SIZE = 500
+
+
+def load_vectors_from_index(client: SearchClient, limit: int) -> np.ndarray:
+    results = client.search(search_text="*", select=["id", "contentVector"], top=limit)
+    vectors = [result["contentVector"] for result in results if result.get("contentVector")]
+    if not vectors:
+        raise ValueError("The source index returned no vectors (is 'contentVector' stored?)")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def exact_knn(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = normalize(queries) @ normalize(corpus).T
+    top = np.argpartition(-scores, kth=min(k, corpus.shape[0] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def wait_for_documents(client: SearchClient, expected: int, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while client.get_document_count() < expected:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Index did not reach {expected} documents in {timeout}s")
+        time.sleep(2)
+
+
+def run_config(
+    index_client: SearchIndexClient,
+    endpoint: str,
+    credential: AzureKeyCredential,
+    index_name: str,
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    baseline: np.ndarray,
+    k: int,
+    compression: str,
+    dimensions: int,
+    m: int,
+    ef_construction: int,
+    ef_search: int,
+) -> dict:
+    # truncated text-embedding-3 vectors are re-normalised, as the service does
+    corpus = normalize(corpus[:, :dimensions])
+    queries = normalize(queries[:, :dimensions])
+
+    definition = create_index_definition(
+        index_name,
+        model="sweep",
+        dimensions=dimensions,
+        compression=compression,
+        m=m,
+        ef_construction=ef_construction,
+        ef_search=ef_search,
+        stored=False,
+    )
+    started = time.perf_counter()
+    index_client.create_index(definition)
+    client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
+    try:
+        for start in range(0, len(corpus), UPLOAD_BATCH_SIZE):
+            batch = corpus[start : start + UPLOAD_BATCH_SIZE]
+            client.upload_documents(
+                [
+                    {"id": str(start + i), "contentVector": vector.tolist()}
+                    for i, vector in enumerate(batch)
+                ]
+            )
+        wait_for_documents(client, len(corpus))
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, baseline):
+            vector_query = VectorizedQuery(
+                vector=query.tolist(), k_nearest_neighbors=k, fields="contentVector"
+            )
+            started = time.perf_counter()
+            results = list(client.search(vector_queries=[vector_query], select=["id"], top=k))
+            latencies.append(time.perf_counter() - started)
+            found = {int(result["id"]) for result in results}
+            hits += len(found.intersection(expected.tolist()))
+
+        storage = index_client.get_index_statistics(index_name)
+    finally:
+        index_client.delete_index(index_name)
+
+    return {
+        "compression": compression,
+        "dimensions": dimensions,
+        "m": m,
+        "ef_construction": ef_construction,
+        "ef_search": ef_search,
+        f"recall@{k}": round(hits / (k * len(queries)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "build_s": round(build_seconds, 1),
+        "vector_index_bytes": storage.get("vector_index_size"),
+        "storage_bytes": storage.get("storage_size"),
+    }
+
+
+def sweep(args) -> list[dict]:
+    endpoint = os.environ["SEARCH_SERVICE_ENDPOINT"]
+    credential = AzureKeyCredential(os.environ["SEARCH_API_KEY"])
+    index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        source = SearchClient(endpoint=endpoint, index_name=args.source_index, credential=credential)
+        vectors = load_vectors_from_index(source, args.limit)
+
+    if len(vectors) <= args.queries:
+        raise ValueError("Need more vectors than held-out queries")
+    corpus, queries = vectors[: -args.queries], vectors[-args.queries :]
+    k = min(args.k, len(corpus))
+    baseline = exact_knn(corpus, queries, k)
+    logger.info(f"📐 Exact baseline: {len(corpus)} vectors, {len(queries)} queries, k={k}")
+
+    results = []
+    grid = itertools.product(
+        args.compression,
+        [d or vectors.shape[1] for d in args.dimensions],
+        args.m,
+        args.ef_construction,
+        args.ef_search,
+    )
+    for i, (compression, dimensions, m, ef_construction, ef_search) in enumerate(grid):
+        result = run_config(
+            index_client,
+            endpoint,
+            credential,
+            f"{args.prefix}-{i}",
+            corpus,
+            queries,
+            baseline,
+            k,
+            compression,
+            dimensions,
+            m,
+            ef_construction,
+            ef_search,
+        )
+        logger.info(json.dumps(result))
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-index", type=str, help="index to read contentVector values from")
+    source.add_argument("--vectors", type=str, help="path to a .npy matrix of embeddings")
+    parser.add_argument("--limit", type=int, default=5000, help="max vectors to read from the index")
+    parser.add_argument("--queries", type=int, default=100, help="held-out query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--compression", nargs="+", default=["none", "scalar", "binary"])
+    parser.add_argument(
+        "--dimensions", nargs="+", type=int, default=[0], help="0 keeps the full dimension"
+    )
+    parser.add_argument("--m", nargs="+", type=int, default=[4, 8])
+    parser.add_argument("--ef-construction", nargs="+", type=int, default=[400])
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[100, 500])
+    parser.add_argument("--prefix", type=str, default="vector-sweep")
+    parser.add_argument("--output", type=str, help="optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = sweep(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)